@@ -0,0 +1,149 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+
+class AdmissionRejected(Exception):
+    """Raised when a submission cannot be admitted; carries a Retry-After hint in seconds"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded, fair admission queue for expensive submissions.
+
+    At most max_in_flight submissions run at once and at most max_queue wait.
+    When a slot frees up, the waiting token with the fewest running submissions
+    goes next (ties taken round-robin), so one busy client cannot starve the
+    others. Waiting longer than queue_timeout, or arriving when the queue is
+    full, is rejected immediately.
+    """
+
+    def __init__(self, max_in_flight=4, max_queue=16, queue_timeout=30.0, max_per_token=0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_per_token = max_per_token
+
+        self.in_flight = 0
+        self.in_flight_by_token = {}
+        self.waiters = OrderedDict()  # token -> deque of futures, in arrival order
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.recent_waits = deque(maxlen=1000)
+        self.recent_service_times = deque(maxlen=100)
+
+    @property
+    def queued(self):
+        return sum(len(waiting) for waiting in self.waiters.values())
+
+    def _retry_after(self):
+        """Rough time until a queue slot frees up, from recent service times"""
+        service_time = (
+            sum(self.recent_service_times) / len(self.recent_service_times)
+            if self.recent_service_times else 5.0
+        )
+        return max(1, math.ceil(service_time * (self.queued + 1) / self.max_in_flight))
+
+    def _token_load(self, token):
+        return self.in_flight_by_token.get(token, 0) + len(self.waiters.get(token, ()))
+
+    def _grant(self, token):
+        self.in_flight += 1
+        self.in_flight_by_token[token] = self.in_flight_by_token.get(token, 0) + 1
+        self.admitted += 1
+
+    def _dispatch(self):
+        """Hand free slots to waiting tokens, fewest running submissions first"""
+        while self.in_flight < self.max_in_flight and self.waiters:
+            # min() picks the first of equally loaded tokens; served tokens move to the back
+            token = min(self.waiters, key=lambda t: self.in_flight_by_token.get(t, 0))
+            waiting = self.waiters[token]
+            future = waiting.popleft()
+            if waiting:
+                self.waiters.move_to_end(token)
+            else:
+                del self.waiters[token]
+            if future.done():
+                continue
+            self._grant(token)
+            future.set_result(None)
+
+    async def acquire(self, token):
+        """Wait for a slot; raises AdmissionRejected if the queue is full or the wait is too long"""
+        if self.max_per_token and self._token_load(token) >= self.max_per_token:
+            self.rejected += 1
+            raise AdmissionRejected("Too many concurrent submissions for this token", self._retry_after())
+        if self.in_flight < self.max_in_flight and not self.waiters:
+            self._grant(token)
+            self.recent_waits.append(0.0)
+            return
+
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected("Server is at capacity", self._retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(token, deque()).append(future)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(future, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(token, future)
+            self.timed_out += 1
+            raise AdmissionRejected("Timed out waiting in the admission queue", self._retry_after())
+        except asyncio.CancelledError:
+            # The client went away while queued
+            self._abandon(token, future)
+            raise
+        self.recent_waits.append(time.monotonic() - started)
+
+    def _abandon(self, token, future):
+        """Leave the queue; a slot granted in the same loop iteration as the timeout is handed back"""
+        if future.done() and not future.cancelled():
+            self.release(token)
+            return
+        waiting = self.waiters.get(token)
+        if waiting is not None and future in waiting:
+            waiting.remove(future)
+            if not waiting:
+                del self.waiters[token]
+
+    def release(self, token, service_time=None):
+        self.in_flight -= 1
+        self.in_flight_by_token[token] -= 1
+        if not self.in_flight_by_token[token]:
+            del self.in_flight_by_token[token]
+        if service_time is not None:
+            self.recent_service_times.append(service_time)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, token):
+        await self.acquire(token)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(token, time.monotonic() - started)
+
+    def metrics(self):
+        waits = sorted(self.recent_waits)
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queue_depth": self.queued,
+            "max_queue": self.max_queue,
+            "admitted_total": self.admitted,
+            "rejected_total": self.rejected,
+            "timed_out_total": self.timed_out,
+            "queue_wait_avg_seconds": sum(waits) / len(waits) if waits else 0.0,
+            "queue_wait_p95_seconds": waits[int(len(waits) * 0.95)] if waits else 0.0,
+        }
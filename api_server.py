@@ -1,16 +1,25 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import uvicorn
+import asyncio
 import os
 import sys
 import requests
-import tempfile
+from collections import Counter
 import importlib.util
 from pathlib import Path
 
+from admission import AdmissionController, AdmissionRejected
+from scheduler import StageScheduler
+from bot_pool import BotPool
+from profiling import Profiler
+from artifacts import INDEX_ROOT, ArtifactStore, document_id, download_dir, extraction_dir, image_dir, index_dir
+from deadline import Deadline
+
 # Add the directories to the path
 sys.path.append(str(Path(__file__).parent / "clause-matcher"))
 sys.path.append(str(Path(__file__).parent / "pdf-extract"))
@@ -27,67 +36,174 @@ clause_spec.loader.exec_module(clause_main)
 
 # Now we can use the functions
 PolicyQueryBot = clause_main.PolicyQueryBot
+SemanticSearch = clause_main.SemanticSearch
+PageIndex = clause_main.PageIndex
+PolicyLibrary = clause_main.PolicyLibrary
+LibrarySearch = clause_main.LibrarySearch
+EMBEDDING_MODEL_NAME = clause_main.EMBEDDING_MODEL_NAME
 create_output_structure = pdf_main.create_output_structure
-extract_from_pdf = pdf_main.extract_from_pdf
+compute_page_hashes = pdf_main.compute_page_hashes
+extract_page_texts = pdf_main.extract_page_texts
+detect_format = pdf_main.detect_format
+extract_text_from_bytes = pdf_main.extract_text_from_bytes
 
-def download_pdf(url: str, temp_dir: str) -> str:
-    """Download PDF from URL and return local file path"""
-    try:
-        response = requests.get(url, stream=True, timeout=30)
-        response.raise_for_status()
-        
-        # Generate filename from URL or use default
-        filename = url.split('/')[-1].split('?')[0]
-        if not filename.endswith('.pdf'):
-            filename = 'document.pdf'
-        
-        pdf_path = os.path.join(temp_dir, filename)
-        
-        with open(pdf_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        
-        return pdf_path
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Failed to download PDF: {str(e)}")
+# Blocking work runs on per-stage executors so the event loop (and /api/v1/health) stays responsive
+scheduler = StageScheduler(
+    io_workers=int(os.getenv("IO_WORKERS", "16")),
+    extract_workers=int(os.getenv("EXTRACT_WORKERS", "2")),
+    embed_workers=int(os.getenv("EMBED_WORKERS", "2")),
+    llm_workers=int(os.getenv("LLM_WORKERS", "8")),
+    # PyMuPDF is not thread-safe, so PDF work runs in worker processes by default (see pdf_main.FITZ_LOCK)
+    extract_executor=os.getenv("EXTRACT_EXECUTOR", "process"),
+)
+
+# "background" (default), "on_demand", "eager" or "off" - see extract_from_pdf
+IMAGE_EXTRACTION = os.getenv("IMAGE_EXTRACTION", "background")
+
+# Local PDF for each processed document, so its images can be rendered on demand
+_document_pdfs = {}
+
+# Downloads, extractions and images under INDEX_ROOT are swept every ARTIFACT_SWEEP_SECONDS: superseded
+# downloads/extractions are deleted, then the artifacts of documents idle over ARTIFACT_MAX_AGE_HOURS, then
+# those of least recently used documents until they fit ARTIFACT_QUOTA_MB (0 = no limit). Indexes are kept
+artifact_store = ArtifactStore(
+    INDEX_ROOT,
+    quota_bytes=int(float(os.getenv("ARTIFACT_QUOTA_MB", "0")) * 1024 * 1024),
+    max_age_seconds=float(os.getenv("ARTIFACT_MAX_AGE_HOURS", "0")) * 3600,
+    min_idle_seconds=float(os.getenv("ARTIFACT_MIN_IDLE_SECONDS", "600")),
+)
+ARTIFACT_SWEEP_SECONDS = float(os.getenv("ARTIFACT_SWEEP_SECONDS", "300"))
+
+def register_pdf(doc_id: str, pdf_path: str):
+    """Serve images from pdf_path from now on; the download it replaces is deleted"""
+    previous = _document_pdfs.get(doc_id)
+    _document_pdfs[doc_id] = pdf_path
+    if previous and previous != pdf_path:
+        artifact_store.discard(previous)
+
+# Persistent multi-policy library (sharded by insurer, filterable by chunk metadata)
+LIBRARY_ROOT = os.getenv("LIBRARY_ROOT", str(Path(__file__).parent / "library"))
+_library = None
+
+def get_library():
+    """Open the policy library on first use"""
+    global _library
+    if _library is None:
+        dim = clause_main.get_embedding_model().get_sentence_embedding_dimension()
+        _library = PolicyLibrary(LIBRARY_ROOT, dim)
+    return _library
+
+def fetch_document(document_url: str):
+    """Load document bytes from a URL, full path or filename in documents/.
+    
+    Returns (data, content_type, filename, local_path); local_path is None for URLs.
+    """
+    if document_url.startswith(('http://', 'https://')):
+        try:
+            response = requests.get(document_url, timeout=30)
+            response.raise_for_status()
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Failed to download document: {str(e)}")
+        filename = document_url.split('/')[-1].split('?')[0]
+        return response.content, response.headers.get('Content-Type'), filename, None
+    
+    local_path = document_url
+    if not os.path.exists(local_path):
+        local_path = str(Path(__file__).parent / "documents" / document_url)
+        if not os.path.exists(local_path):
+            raise HTTPException(status_code=404, detail=f"Document not found: {document_url}")
+    with open(local_path, 'rb') as f:
+        return f.read(), None, Path(local_path).name, local_path
+
+def write_file(path: str, data: bytes):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+# Pages extracted per step while streaming a new PDF into its index
+PAGE_BATCH_SIZE = int(os.getenv("PAGE_BATCH_SIZE", "8"))
+
+# Fire-and-forget work; references are kept so tasks are not garbage collected mid-flight
+_background_tasks = set()
+
+def run_in_background(coroutine):
+    task = asyncio.ensure_future(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def stream_pages_into(search_engine, pdf_path: str, page_hashes: List[str]):
+    """Extract page text in batches, embedding each batch while the next one is being extracted"""
+    pending_embed = None
+    for start in range(0, len(page_hashes), PAGE_BATCH_SIZE):
+        pages = list(range(start, min(start + PAGE_BATCH_SIZE, len(page_hashes))))
+        texts = await scheduler.run_in_module("extract", pdf_main, "extract_page_texts", pdf_path, pages)
+        headings = await scheduler.run_in_module("extract", pdf_main, "extract_page_headings", pdf_path, pages)
+        if pending_embed is not None:
+            await pending_embed
+        pending_embed = asyncio.ensure_future(scheduler.run(
+            "embed",
+            search_engine.add_pages,
+            [texts[page] for page in pages],
+            [page_hashes[page] for page in pages],
+            [headings[page] for page in pages],
+        ))
+    if pending_embed is not None:
+        await pending_embed
 
-def process_pdf_url(pdf_url: str) -> str:
-    """Download PDF and extract text, return path to extracted text file"""
+async def build_search_engine(pdf_url: str, pdf_path: str, artifacts: bool = True):
+    """Build a SemanticSearch for a PDF, reusing the stored index for pages that did not change"""
+    doc_id = document_id(pdf_url)
+    document_index_dir = index_dir(doc_id)
+    # The sweep must not delete the index or the PDF while they are being built from
+    artifact_store.acquire(document_index_dir)
     try:
-        # Create temporary directory for processing
-        temp_dir = tempfile.mkdtemp()
+        page_hashes = await scheduler.run_in_module("extract", pdf_main, "compute_page_hashes", pdf_path)
+        register_pdf(doc_id, pdf_path)
         
-        # Check if it's a URL, local file path, or just a filename
-        if pdf_url.startswith(('http://', 'https://')):
-            # It's a URL - download it
-            pdf_path = download_pdf(pdf_url, temp_dir)
-        elif os.path.exists(pdf_url):
-            # It's a local file with full path
-            pdf_path = pdf_url
-        else:
-            # Check if it's in the documents folder
-            documents_dir = Path(__file__).parent / "documents"
-            potential_path = documents_dir / pdf_url
+        stored_index = await scheduler.run("io", PageIndex.load, document_index_dir, model_name=EMBEDDING_MODEL_NAME)
+        if stored_index is None:
+            # First version of this document - stream page text into chunking/embedding
+            search_engine = await scheduler.run(
+                "embed", lambda: SemanticSearch(page_index=SemanticSearch.empty_page_index())
+            )
+            await stream_pages_into(search_engine, pdf_path, page_hashes)
+            # Compressed indexes are trained once every page is in, not on the first batch
+            await scheduler.run("embed", search_engine.page_index.train_compression)
+            if search_engine.cleaning_report:
+                print(clause_main.describe_report(search_engine.cleaning_report))
+            await scheduler.run("io", search_engine.page_index.save, document_index_dir)
             
-            if potential_path.exists():
-                pdf_path = str(potential_path)
-            else:
-                # Try relative path from current directory
-                if os.path.exists(pdf_url):
-                    pdf_path = pdf_url
-                else:
-                    raise FileNotFoundError(f"PDF not found: {pdf_url}. Checked: {potential_path}")
-        
-        # Extract content using existing PDF extractor
-        folders = create_output_structure(pdf_path)
-        extract_from_pdf(pdf_path, folders)
-        
-        # Return path to extracted text
-        text_file = os.path.join(folders['text'], "pdf_text.txt")
-        return text_file
+            # Tables and the text file are artifacts nobody waits for; each ingestion writes
+            # them to its own folder so concurrent runs never collide. Images go to the
+            # document's image cache, which the image endpoint serves from
+            if artifacts:
+                folders = create_output_structure(pdf_path, root=extraction_dir(doc_id), images_folder=image_dir(doc_id))
+                artifact_store.acquire(pdf_path, folders['main'], folders['images'])
+                task = run_in_background(scheduler.run_in_module(
+                    "extract", pdf_main, "extract_from_pdf", pdf_path, folders, images=IMAGE_EXTRACTION
+                ))
+                task.add_done_callback(lambda _: artifact_store.release(pdf_path, folders['main'], folders['images']))
+            return search_engine
         
+        # Known document - only extract and embed pages whose content changed
+        search_engine = await scheduler.run("embed", SemanticSearch, page_index=stored_index)
+        _, changed = stored_index.plan_update(page_hashes)
+        changed_texts = await scheduler.run_in_module("extract", pdf_main, "extract_page_texts", pdf_path, changed)
+        changed_headings = await scheduler.run_in_module("extract", pdf_main, "extract_page_headings", pdf_path, changed)
+        changed_pages = await scheduler.run(
+            "embed", search_engine.update_pages, page_hashes, lambda pages: changed_texts, changed_headings
+        )
+        if search_engine.page_index is not stored_index:
+            print(f"Re-indexed {len(changed_pages)} of {len(page_hashes)} pages for {pdf_url}")
+            await scheduler.run("io", search_engine.page_index.save, document_index_dir)
+        return search_engine
+    
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process PDF: {str(e)}")
+    finally:
+        artifact_store.release(document_index_dir)
 
 app = FastAPI(
     title="Retrieval System API",
@@ -123,24 +239,248 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
 class QueryRequest(BaseModel):
     documents: List[str]
     questions: List[str]
+    # Add per-answer token counts to the response
+    include_usage: bool = False
 
 class Answer(BaseModel):
     question: str
     answer: str
+    usage: Optional[Dict[str, int]] = None
+    partial: Optional[bool] = None
 
 class QueryResponse(BaseModel):
     answers: List[Answer]
+    partial: Optional[bool] = None
+    degraded: Optional[List[str]] = None
+
+class LibraryDocument(BaseModel):
+    url: str
+    insurer: str = ""
+    policy_name: str = ""
+    version: str = ""
+
+class LibraryIngestRequest(BaseModel):
+    documents: List[LibraryDocument]
+
+class LibraryQueryRequest(BaseModel):
+    questions: List[str]
+    # e.g. {"insurer": "National", "policy_name": ["Parivar Mediclaim Plus"]}
+    filters: Dict[str, Any] = {}
+    # Most chunks per question; adaptive retrieval may use fewer
+    top_k: int = 5
+    include_usage: bool = False
+
+# Ready bots are kept per worker in an LRU pool keyed by document identity
+def estimate_bot_bytes(bot) -> int:
+    """Resident memory of a bot's index and chunks"""
+    page_index = getattr(bot.search_engine, 'page_index', None)
+    if page_index is None:
+        return 0
+    return sum(page_index.memory_footprint().values())
+
+bot_pool = BotPool(
+    budget_bytes=int(float(os.getenv("BOT_POOL_BUDGET_MB", "512")) * 1024 * 1024),
+    size_fn=estimate_bot_bytes,
+    ttl_seconds=float(os.getenv("BOT_POOL_TTL_SECONDS", "600")),
+)
+
+def env_list(name: str) -> List[str]:
+    return [item.strip() for item in os.getenv(name, "").split(",") if item.strip()]
 
-# Don't initialize bot here - we'll create it dynamically for each request
+@app.on_event("startup")
+async def load_embedding_model():
+    """Load the sentence embedding model on the embed stage, so no request loads it on the event loop"""
+    run_in_background(scheduler.run("embed", clause_main.get_embedding_model))
 
-@app.post("/api/v1/hackrx/run", response_model=QueryResponse)
+@app.on_event("startup")
+async def preload_documents():
+    """Build bots for BOT_POOL_PRELOAD documents in the background; they stay pinned"""
+    async def preload():
+        for document_url in env_list("BOT_POOL_PRELOAD"):
+            try:
+                bot_pool.pin(document_id(document_url))
+                await load_bot(document_url)
+                print(f"Preloaded {document_url}")
+            except Exception as e:
+                print(f"Could not preload {document_url}: {e}")
+    run_in_background(preload())
+
+@app.on_event("startup")
+async def sweep_artifacts():
+    """Keep the artifacts under INDEX_ROOT within their quota and age limits (ARTIFACT_SWEEP_SECONDS=0 disables sweeping)"""
+    if ARTIFACT_SWEEP_SECONDS <= 0:
+        return
+    async def sweep():
+        while True:
+            try:
+                # Documents loaded in memory or being ingested keep their PDFs for image requests
+                protected = set(bot_pool.entries) | set(_inflight_ingestions)
+                for doc_id in await scheduler.run("io", artifact_store.sweep, protected):
+                    _document_pdfs.pop(doc_id, None)
+                    print(f"Evicted artifacts of {doc_id}")
+            except Exception as e:
+                print(f"Artifact sweep failed: {e}")
+            await asyncio.sleep(ARTIFACT_SWEEP_SECONDS)
+    run_in_background(sweep())
+
+# Bounded admission queue: shed load with 429 instead of letting every request time out together
+admission = AdmissionController(
+    max_in_flight=int(os.getenv("MAX_IN_FLIGHT", "4")),
+    max_queue=int(os.getenv("MAX_QUEUE", "16")),
+    queue_timeout=float(os.getenv("QUEUE_TIMEOUT_SECONDS", "30")),
+    max_per_token=int(os.getenv("MAX_PER_TOKEN", "0")),
+)
+
+# Opt-in stack/memory profiles taken while a submission runs (X-Profile: 1 or POST /api/v1/profiles/arm).
+# They are process-wide: concurrent requests show up in them too
+profiler = Profiler(
+    os.getenv("PROFILE_DIR", str(Path(__file__).parent / "profiles")),
+    interval=float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5")) / 1000,
+    # Snapshot filtering and file writes go to the io stage, off the event loop
+    write_fn=lambda fn, *args: run_in_background(scheduler.run("io", fn, *args)),
+)
+
+# Per-submission latency budget (X-Deadline-Ms header, or this default; 0 = no deadline).
+# When the time left gets short, optional work is dropped in ladder order; each step is taken
+# once fewer than this many expected LLM answer times remain
+SUBMISSION_DEADLINE_SECONDS = float(os.getenv("SUBMISSION_DEADLINE_SECONDS", "0"))
+LLM_ANSWER_SECONDS = float(os.getenv("LLM_ANSWER_SECONDS", "3"))
+RESPONSE_MARGIN_SECONDS = float(os.getenv("RESPONSE_MARGIN_SECONDS", "0.5"))
+DEGRADATION_LADDER = {
+    "skip_artifacts": 6,
+    "skip_llm_parse": 3,
+    "reduce_top_k": 2.5,
+    "skip_rerank": 2,
+    "fast_model": 1.5,
+}
+PARTIAL_ANSWER = "Could not answer within the time limit."
+_degradations = Counter()
+
+def submission_deadline(x_deadline_ms: Optional[str]) -> Deadline:
+    """Deadline from the request header, falling back to the configured default"""
+    budget = SUBMISSION_DEADLINE_SECONDS
+    if x_deadline_ms:
+        try:
+            budget = float(x_deadline_ms) / 1000
+        except ValueError:
+            raise HTTPException(status_code=400, detail="X-Deadline-Ms must be a number of milliseconds")
+    return Deadline(budget if budget > 0 else None)
+
+def degrade(deadline: Deadline, step: str) -> bool:
+    """Take a ladder step if its expected cost no longer fits the time left"""
+    llm_seconds = clause_main.token_usage.average_seconds("answer", LLM_ANSWER_SECONDS)
+    if deadline.degrade(step, DEGRADATION_LADDER[step] * llm_seconds):
+        _degradations[step] += 1
+        return True
+    return False
+
+@app.post("/api/v1/hackrx/run", response_model=QueryResponse, response_model_exclude_none=True)
 async def run_submission(
     request: QueryRequest,
-    token: str = Depends(verify_token)
+    response: Response,
+    token: str = Depends(verify_token),
+    x_profile: Optional[str] = Header(None),
+    x_deadline_ms: Optional[str] = Header(None)
 ):
     """
     Run submissions - process questions against the provided documents
     """
+    # The clock starts on arrival, so time spent queued for admission counts against the budget
+    deadline = submission_deadline(x_deadline_ms)
+    try:
+        async with admission.slot(token):
+            with profiler.capture(x_profile == "1", label=", ".join(request.documents)) as profile_id:
+                if profile_id is not None:
+                    response.headers["X-Profile-Id"] = profile_id
+                return await process_submission(request, deadline)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+async def load_search_engine(document_url: str, artifacts: bool = True):
+    """Download, extract and index a document"""
+    # Detect the format from the content itself, not from the URL or file extension
+    data, content_type, filename, local_path = await scheduler.run("io", fetch_document, document_url)
+    document_format = detect_format(data, content_type, filename)
+    
+    if document_format == 'pdf':
+        # PDF - reuse the stored index of a previous version where pages are unchanged
+        if local_path is None:
+            local_path = os.path.join(download_dir(document_id(document_url)), 'document.pdf')
+            await scheduler.run("io", write_file, local_path, data)
+        try:
+            return await build_search_engine(document_url, local_path, artifacts=artifacts)
+        except Exception:
+            # Nothing else will read a download whose ingestion failed (local documents are never deleted)
+            if _document_pdfs.get(document_id(document_url)) != local_path:
+                artifact_store.discard(local_path)
+            raise
+    
+    # DOCX, EML (with PDF/DOCX attachments) or plain text - extracted in memory
+    text = await scheduler.run_in_module(
+        "extract", pdf_main, "extract_text_from_bytes", data, content_type, filename
+    )
+    return await scheduler.run("embed", SemanticSearch, text=text)
+
+# Ingestions in flight by document identity, so concurrent requests for one document share one build
+_inflight_ingestions = {}
+
+async def ingest_document(document_url: str, pool_key: str, artifacts: bool = True):
+    search_engine = await load_search_engine(document_url, artifacts=artifacts)
+    bot = PolicyQueryBot(search_engine=search_engine, verbose=False)
+    bot_pool.put(pool_key, bot)
+    return bot
+
+async def load_bot(document_url: str, artifacts: bool = True):
+    """Ready bot for a document: pooled, joined from an in-flight ingestion, or newly ingested"""
+    pool_key = document_id(document_url)
+    artifact_store.touch(pool_key)
+    bot = bot_pool.get(pool_key)
+    if bot is not None:
+        return bot
+    
+    task = _inflight_ingestions.get(pool_key)
+    if task is None:
+        task = asyncio.ensure_future(ingest_document(document_url, pool_key, artifacts))
+        _inflight_ingestions[pool_key] = task
+        
+        def forget(finished_task):
+            if _inflight_ingestions.get(pool_key) is finished_task:
+                del _inflight_ingestions[pool_key]
+        task.add_done_callback(forget)
+    else:
+        print(f"Joining in-flight ingestion of {document_url}")
+    # Shielded: one waiter giving up must not cancel the ingestion the others are waiting on
+    return await asyncio.shield(task)
+
+async def prepare_queries(questions: List[str], llm_parse: bool = True):
+    """Parse and embed the questions; needs no document, so it overlaps with document loading"""
+    parsed_queries = await scheduler.run("embed", clause_main.parse_queries_locally, questions)
+    # Low-confidence parses go to Gemini, all at once
+    if llm_parse:
+        parsed_queries = await asyncio.gather(*(
+            scheduler.run("llm", clause_main.refine_parse, question, parsed)
+            for question, parsed in zip(questions, parsed_queries)
+        ))
+    search_embeddings = await scheduler.run("embed", clause_main.embed_search_queries, questions, parsed_queries)
+    return list(parsed_queries), search_embeddings
+
+def partial_response(questions: List[str], deadline: Deadline) -> QueryResponse:
+    """Response for a submission that ran out of time before retrieval"""
+    deadline.degrade("partial", float("inf"))
+    _degradations["partial"] += 1
+    return QueryResponse(
+        answers=[Answer(question=question, answer=PARTIAL_ANSWER, partial=True) for question in questions],
+        partial=True,
+        degraded=deadline.steps,
+    )
+
+async def process_submission(request: QueryRequest, deadline: Deadline = None) -> QueryResponse:
+    """Answer the questions of an admitted submission within its deadline"""
+    deadline = deadline or Deadline()
     try:
         answers = []
         
@@ -149,44 +489,239 @@ async def run_submission(
             raise HTTPException(status_code=400, detail="No documents provided")
         
         document_url = request.documents[0]
+        questions = request.questions
         
-        # Check if it's a URL, local PDF, or local text file
-        if document_url.startswith(('http://', 'https://')):
-            # Download and process PDF from URL
-            text_file = process_pdf_url(document_url)
-        elif document_url.endswith('.pdf'):
-            # Local PDF file - extract text
-            text_file = process_pdf_url(document_url)
-        else:
-            # Assume it's already a text file
-            text_file = document_url
+        # The request is a small dependency graph: the document and the questions are prepared
+        # concurrently, and only search and answer generation need both. A hot document comes
+        # straight from the pool; one that is already being ingested is awaited, not rebuilt
+        document_task = asyncio.ensure_future(load_bot(
+            document_url, artifacts=not degrade(deadline, "skip_artifacts")
+        ))
+        query_task = asyncio.ensure_future(prepare_queries(
+            questions, llm_parse=not degrade(deadline, "skip_llm_parse")
+        ))
+        try:
+            # A shielded ingestion keeps running after a timeout, so the next request finds it pooled
+            bot = await asyncio.wait_for(document_task, deadline.timeout(RESPONSE_MARGIN_SECONDS))
+            parsed_queries, search_embeddings = await asyncio.wait_for(
+                query_task, deadline.timeout(RESPONSE_MARGIN_SECONDS)
+            )
+        except asyncio.TimeoutError:
+            return partial_response(questions, deadline)
+        finally:
+            for task in (document_task, query_task):
+                task.cancel()
         
-        # Initialize bot with the processed document
-        bot = PolicyQueryBot(text_file, verbose=False)
+        # Step: cheaper retrieval when the remaining budget cannot afford the full one
+        top_k = clause_main.MIN_TOP_K if degrade(deadline, "reduce_top_k") else None
+        rerank = not degrade(deadline, "skip_rerank")
+        batch_results = await scheduler.run(
+            "embed", bot.retrieve, questions, parsed_queries, top_k, search_embeddings, rerank
+        )
         
-        # Process each question
-        for question in request.questions:
-            # Use our existing bot to get the answer
-            answer_text = bot.get_final_answer(question)
-            
-            answers.append(Answer(
-                question=question,
-                answer=answer_text
+        # Step: answer generation, on the fast model if time is short
+        fast = degrade(deadline, "fast_model")
+        tasks = [
+            asyncio.ensure_future(scheduler.run(
+                "llm", bot.answer_with_usage, question, relevant_results=results, parsed_query=parsed, fast=fast
             ))
+            for question, parsed, results in zip(questions, parsed_queries, batch_results)
+        ]
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=deadline.timeout(RESPONSE_MARGIN_SECONDS))
+            for task in pending:
+                task.cancel()
+        
+        partial = False
+        for question, parsed, results, task in zip(questions, parsed_queries, batch_results, tasks):
+            if task.done() and not task.cancelled():
+                answer_text, usage = task.result()
+                answers.append(Answer(
+                    question=question,
+                    answer=answer_text,
+                    usage=usage if request.include_usage else None
+                ))
+                continue
+            # Out of time: quote the matching clause if there is one, else say so
+            partial = True
+            extracted, _ = clause_main.extract_answer(parsed, results)
+            answers.append(Answer(question=question, answer=extracted or PARTIAL_ANSWER, partial=True))
+        if partial:
+            deadline.degrade("partial", float("inf"))
+            _degradations["partial"] += 1
         
-        return QueryResponse(answers=answers)
+        return QueryResponse(
+            answers=answers,
+            partial=True if partial else None,
+            degraded=deadline.steps or None,
+        )
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error processing request: {str(e)}"
         )
 
+@app.post("/api/v1/library/documents")
+async def ingest_library_documents(
+    request: LibraryIngestRequest,
+    token: str = Depends(verify_token)
+):
+    """
+    Add policies to the persistent library (a new version replaces the previous one)
+    """
+    library = await scheduler.run("io", get_library)
+    ingested = []
+    for document in request.documents:
+        data, content_type, filename, _ = await scheduler.run("io", fetch_document, document.url)
+        text = await scheduler.run_in_module(
+            "extract", pdf_main, "extract_text_from_bytes", data, content_type, filename
+        )
+        pages, report = await scheduler.run("embed", clause_main.clean_document_pages, text)
+        
+        doc_id = document_id(document.url)
+        chunk_count = await scheduler.run(
+            "embed",
+            library.add_document,
+            doc_id,
+            pages,
+            clause_main.split_into_chunks,
+            clause_main.encode_chunks,
+            insurer=document.insurer,
+            policy_name=document.policy_name,
+            version=document.version,
+        )
+        if report is not None:
+            report["chunks_after"] = chunk_count
+            print(clause_main.describe_report(report))
+        ingested.append({"doc_id": doc_id, "url": document.url, "chunks": chunk_count})
+    
+    return {"ingested": ingested}
+
+@app.get("/api/v1/library/documents")
+async def list_library_documents(token: str = Depends(verify_token)):
+    """List policies in the library"""
+    library = await scheduler.run("io", get_library)
+    return {"documents": await scheduler.run("io", library.documents)}
+
+@app.post("/api/v1/library/query", response_model=QueryResponse, response_model_exclude_none=True)
+async def query_library(
+    request: LibraryQueryRequest,
+    token: str = Depends(verify_token)
+):
+    """
+    Answer questions against every library policy matching the metadata filters
+    """
+    try:
+        library = await scheduler.run("io", get_library)
+        search_engine = await scheduler.run("embed", LibrarySearch, library, filters=request.filters)
+        bot = PolicyQueryBot(search_engine=search_engine, verbose=False)
+        parsed_queries, search_embeddings = await prepare_queries(request.questions)
+        batch_results = await scheduler.run(
+            "embed", bot.retrieve, request.questions, parsed_queries, request.top_k, search_embeddings
+        )
+        answered = await asyncio.gather(*(
+            scheduler.run("llm", bot.answer_with_usage, question, relevant_results=results, parsed_query=parsed)
+            for question, parsed, results in zip(request.questions, parsed_queries, batch_results)
+        ))
+        return QueryResponse(answers=[
+            Answer(question=question, answer=answer_text, usage=usage if request.include_usage else None)
+            for question, (answer_text, usage) in zip(request.questions, answered)
+        ])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def registered_pdf(doc_id: str) -> str:
+    pdf_path = _document_pdfs.get(doc_id)
+    if pdf_path is None or not os.path.exists(pdf_path):
+        raise HTTPException(status_code=404, detail=f"Unknown document: {doc_id}")
+    return pdf_path
+
+@app.get("/api/v1/documents/{doc_id}/images")
+async def list_document_images(doc_id: str, token: str = Depends(verify_token)):
+    """List distinct images of a processed PDF and the pages they appear on"""
+    with artifact_store.in_use(index_dir(doc_id)):
+        images = await scheduler.run_in_module("extract", pdf_main, "list_pdf_images", registered_pdf(doc_id))
+    return {"doc_id": doc_id, "images": images}
+
+@app.get("/api/v1/documents/{doc_id}/images/{xref}")
+async def get_document_image(doc_id: str, xref: int, token: str = Depends(verify_token)):
+    """Render one image of a processed PDF on first request, then serve the cached PNG"""
+    # Unknown ids are rejected before the id is used in any path
+    pdf_path = registered_pdf(doc_id)
+    image_file = os.path.join(image_dir(doc_id), pdf_main.image_file_name(xref))
+    if not os.path.exists(image_file):
+        # Rendered with the other PyMuPDF work; the sweep leaves the PDF and the image cache alone meanwhile
+        artifact_store.touch(doc_id)
+        with artifact_store.in_use(index_dir(doc_id)):
+            rendered = await scheduler.run_in_module(
+                "extract", pdf_main, "render_pdf_image", pdf_path, xref, image_file
+            )
+        if not rendered:
+            raise HTTPException(status_code=404, detail=f"No image {xref} in document {doc_id}")
+    return FileResponse(image_file, media_type="image/png")
+
 @app.get("/api/v1/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "message": "API is running"}
 
+class ProfileArmRequest(BaseModel):
+    count: int = 1
+
+@app.post("/api/v1/profiles/arm")
+async def arm_profiler(request: ProfileArmRequest, token: str = Depends(verify_token)):
+    """Profile the next submissions without changing the client"""
+    return {"armed": profiler.arm(request.count)}
+
+@app.get("/api/v1/profiles")
+async def list_profiles(token: str = Depends(verify_token)):
+    """Stored profiles, newest first (process-wide: each covers everything the server did during one submission)"""
+    return {"profiles": await scheduler.run("io", profiler.list)}
+
+@app.get("/api/v1/profiles/{profile_id}/{file_name}")
+async def download_profile(profile_id: str, file_name: str, token: str = Depends(verify_token)):
+    """Download summary.json, stacks.txt (collapsed stacks for flamegraphs) or memory.txt"""
+    path = profiler.path(profile_id, file_name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Unknown profile or file")
+    return FileResponse(path, filename=f"{profile_id}-{file_name}")
+
+class PoolRequest(BaseModel):
+    documents: List[str]
+
+@app.post("/api/v1/pool/pin")
+async def pin_documents(request: PoolRequest, token: str = Depends(verify_token)):
+    """Keep documents' bots in the pool regardless of memory pressure"""
+    for document_url in request.documents:
+        bot_pool.pin(document_id(document_url))
+    return {"pool": bot_pool.metrics()}
+
+@app.post("/api/v1/pool/unpin")
+async def unpin_documents(request: PoolRequest, token: str = Depends(verify_token)):
+    """Make documents' bots evictable again"""
+    for document_url in request.documents:
+        bot_pool.unpin(document_id(document_url))
+    return {"pool": bot_pool.metrics()}
+
+@app.get("/api/v1/metrics")
+async def metrics():
+    """Load metrics for autoscaling (admission queue depth, waits, rejections) and LLM token spend"""
+    return {
+        "admission": admission.metrics(),
+        "stages": scheduler.metrics(),
+        "bot_pool": bot_pool.metrics(),
+        "ingestions_in_flight": len(_inflight_ingestions),
+        "tokens": clause_main.token_usage.metrics(),
+        "confidence_gate": clause_main.confidence_gate.metrics(),
+        "degradations": dict(_degradations),
+        "embedding": clause_main.embedding_metrics(),
+        "embedding_cache": clause_main.embedding_cache_metrics(),
+        "artifacts": artifact_store.metrics(),
+    }
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -0,0 +1,249 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+# Persistent per-document indexes, so a republished policy only re-embeds its changed pages
+INDEX_ROOT = os.getenv("INDEX_ROOT", str(Path(__file__).parent / "indexes"))
+
+
+def document_id(document_url):
+    """Stable identity of a document across versions (URL without query string, or absolute path)"""
+    if document_url.startswith(('http://', 'https://')):
+        # Signed blob URLs change their query string on every request
+        key = document_url.split('?')[0]
+    else:
+        key = os.path.abspath(document_url)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+def index_dir(doc_id):
+    """Where the versioned PageIndex of a document lives"""
+    return os.path.join(INDEX_ROOT, doc_id)
+
+
+def image_dir(doc_id):
+    """Rendered images of a document, shared by extraction and the image endpoint"""
+    return os.path.join(index_dir(doc_id), "images")
+
+
+def download_dir(doc_id):
+    """Fresh folder for one download of a document, inside its managed artifact folder"""
+    path = os.path.join(index_dir(doc_id), "downloads", f"{time.time_ns()}-{os.getpid()}")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def extraction_dir(doc_id):
+    """Fresh artifact folder for one extraction of a document"""
+    return os.path.join(index_dir(doc_id), "extractions", f"{time.time_ns()}-{os.getpid()}")
+
+
+def disk_usage(path):
+    """Bytes of all files under path"""
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(folder, name)).st_size
+            except OSError:
+                # Removed while we walked
+                pass
+    return total
+
+
+class ArtifactStore:
+    """Disk lifecycle of the artifacts under INDEX_ROOT.
+
+    The downloads, extractions and images of a document are one eviction unit;
+    the modification time of the document folder is its last use (see touch).
+    A sweep removes downloads and extractions superseded by a newer one, then
+    the artifacts of documents idle longer than max_age_seconds, then those of
+    least recently used documents until they fit quota_bytes. Index versions
+    are never evicted: they hold the page hashes that incremental updates and
+    ingest.py rely on, and are rebuilt from nothing else. Paths acquired by
+    this process and documents idle for less than min_idle_seconds (which
+    covers other workers sharing the root) are never removed.
+    """
+
+    PRUNED_FOLDERS = ("downloads", "extractions")
+    EVICTED_FOLDERS = ("downloads", "extractions", "images")
+    # Removed folders are renamed here first and deleted outside the lock
+    TRASH = ".trash"
+
+    def __init__(self, root, quota_bytes=0, max_age_seconds=0, min_idle_seconds=600):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.max_age_seconds = max_age_seconds
+        self.min_idle_seconds = min_idle_seconds
+        self.refs = Counter()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.index_bytes = 0
+        self.documents = 0
+        self.sweeps = 0
+        self.pruned = 0
+        self.evicted = 0
+        self.freed_bytes = 0
+
+    def acquire(self, *paths):
+        with self._lock:
+            for path in paths:
+                self.refs[os.path.abspath(path)] += 1
+
+    def release(self, *paths):
+        with self._lock:
+            for path in paths:
+                path = os.path.abspath(path)
+                self.refs[path] -= 1
+                if self.refs[path] <= 0:
+                    del self.refs[path]
+
+    @contextmanager
+    def in_use(self, *paths):
+        self.acquire(*paths)
+        try:
+            yield
+        finally:
+            self.release(*paths)
+
+    def _is_in_use(self, path):
+        """Whether path or something inside it is acquired (call with the lock held)"""
+        path = os.path.abspath(path)
+        return any(ref == path or ref.startswith(path + os.sep) for ref in self.refs)
+
+    def touch(self, doc_id):
+        """Mark a document as just used"""
+        try:
+            os.utime(index_dir(doc_id))
+        except OSError:
+            pass
+
+    def _remove(self, path):
+        """Delete path unless it is in use; returns whether it was removed"""
+        # Only the rename happens under the lock: the event loop takes it in acquire/release, and
+        # deleting a large extraction tree must not stall requests
+        trash_root = os.path.join(self.root, self.TRASH)
+        os.makedirs(trash_root, exist_ok=True)
+        trash = os.path.join(trash_root, f"{time.time_ns()}-{os.getpid()}-{threading.get_ident()}")
+        with self._lock:
+            if self._is_in_use(path):
+                return False
+            try:
+                os.replace(path, trash)
+            except OSError:
+                return False
+        size = disk_usage(trash)
+        shutil.rmtree(trash, ignore_errors=True)
+        self.freed_bytes += size
+        return True
+
+    def discard(self, path):
+        """Delete a superseded download or extraction folder now, if it is managed and unused"""
+        path = os.path.abspath(path)
+        root = os.path.abspath(self.root) + os.sep
+        if not path.startswith(root):
+            # Local documents outside the root are never ours to delete
+            return
+        if os.path.isfile(path):
+            path = os.path.dirname(path)
+        if os.path.basename(os.path.dirname(path)) in self.PRUNED_FOLDERS and self._remove(path):
+            self.pruned += 1
+
+    def _prune_document(self, doc_root, now):
+        """Remove all but the newest download and extraction of a document"""
+        for folder in self.PRUNED_FOLDERS:
+            parent = os.path.join(doc_root, folder)
+            if not os.path.isdir(parent):
+                continue
+            # Folder names start with a nanosecond timestamp, so name order is age order
+            for name in sorted(os.listdir(parent))[:-1]:
+                path = os.path.join(parent, name)
+                if now - os.path.getmtime(path) >= self.min_idle_seconds and self._remove(path):
+                    self.pruned += 1
+
+    def _evict_document(self, doc_root, last_used):
+        """Remove the artifact folders of a document, keeping its index versions"""
+        removed = True
+        for folder in self.EVICTED_FOLDERS:
+            path = os.path.join(doc_root, folder)
+            if os.path.isdir(path):
+                removed = self._remove(path) and removed
+        try:
+            # Removing the folders bumped the document's mtime; keep its real last use
+            os.utime(doc_root, (last_used, last_used))
+        except OSError:
+            pass
+        return removed
+
+    def _empty_trash(self, now):
+        """Delete trash left behind by a process that stopped mid-delete"""
+        trash_root = os.path.join(self.root, self.TRASH)
+        for name in os.listdir(trash_root) if os.path.isdir(trash_root) else []:
+            path = os.path.join(trash_root, name)
+            try:
+                if now - os.path.getmtime(path) >= self.min_idle_seconds:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+
+    def sweep(self, protected=()):
+        """Prune and evict; protected: doc ids to keep (e.g. loaded in memory). Returns evicted doc ids"""
+        now = time.time()
+        self._empty_trash(now)
+        documents = []
+        index_bytes = 0
+        for doc_id in os.listdir(self.root) if os.path.isdir(self.root) else []:
+            doc_root = os.path.join(self.root, doc_id)
+            if doc_id == self.TRASH or not os.path.isdir(doc_root):
+                continue
+            try:
+                self._prune_document(doc_root, now)
+                size = sum(disk_usage(os.path.join(doc_root, folder)) for folder in self.EVICTED_FOLDERS)
+                index_bytes += disk_usage(doc_root) - size
+                if size:
+                    documents.append([os.path.getmtime(doc_root), doc_id, size])
+            except OSError:
+                continue
+
+        # Least recently used first
+        documents.sort()
+        total = sum(size for _, _, size in documents)
+        evicted = []
+        for last_used, doc_id, size in documents:
+            idle = now - last_used
+            expired = self.max_age_seconds and idle > self.max_age_seconds
+            over_quota = self.quota_bytes and total > self.quota_bytes
+            if not (expired or over_quota):
+                continue
+            if doc_id in protected or idle < self.min_idle_seconds:
+                continue
+            if self._evict_document(os.path.join(self.root, doc_id), last_used):
+                total -= size
+                evicted.append(doc_id)
+
+        self.evicted += len(evicted)
+        self.sweeps += 1
+        self.total_bytes = total
+        self.index_bytes = index_bytes
+        self.documents = len(documents) - len(evicted)
+        if self.quota_bytes and total > self.quota_bytes:
+            print(f"Artifacts under {self.root} hold {total} bytes, over their {self.quota_bytes} byte quota; the rest is in use")
+        return evicted
+
+    def metrics(self):
+        return {
+            "bytes": self.total_bytes,
+            "quota_bytes": self.quota_bytes,
+            "index_bytes": self.index_bytes,
+            "documents": self.documents,
+            "in_use": len(self.refs),
+            "sweeps_total": self.sweeps,
+            "pruned_total": self.pruned,
+            "evicted_total": self.evicted,
+            "freed_bytes_total": self.freed_bytes,
+        }
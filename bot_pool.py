@@ -0,0 +1,75 @@
+import time
+from collections import OrderedDict
+
+
+class BotPool:
+    """Per-worker LRU pool of ready PolicyQueryBot instances, bounded by estimated memory.
+
+    Entries are keyed by document identity. Least recently used entries are
+    evicted once the summed size (from size_fn) exceeds budget_bytes; pinned
+    entries are never evicted. Entries older than ttl_seconds are dropped on
+    lookup so a republished document is eventually re-validated.
+    """
+
+    def __init__(self, budget_bytes, size_fn, ttl_seconds=0):
+        self.budget_bytes = budget_bytes
+        self.size_fn = size_fn
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()  # key -> {"bot", "bytes", "loaded_at"}
+        self.pinned = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def total_bytes(self):
+        return sum(entry["bytes"] for entry in self.entries.values())
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and self.ttl_seconds and key not in self.pinned:
+            if time.monotonic() - entry["loaded_at"] > self.ttl_seconds:
+                del self.entries[key]
+                entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry["bot"]
+
+    def put(self, key, bot, pin=False):
+        self.entries[key] = {"bot": bot, "bytes": self.size_fn(bot), "loaded_at": time.monotonic()}
+        self.entries.move_to_end(key)
+        if pin:
+            self.pinned.add(key)
+        self._evict()
+
+    def pin(self, key):
+        self.pinned.add(key)
+
+    def unpin(self, key):
+        self.pinned.discard(key)
+        self._evict()
+
+    def _evict(self):
+        """Drop least recently used unpinned entries until the pool fits its budget"""
+        total = self.total_bytes
+        for key in list(self.entries):
+            if total <= self.budget_bytes:
+                break
+            if key in self.pinned:
+                continue
+            total -= self.entries.pop(key)["bytes"]
+            self.evictions += 1
+
+    def metrics(self):
+        return {
+            "entries": len(self.entries),
+            "pinned": len(self.pinned),
+            "bytes": self.total_bytes,
+            "budget_bytes": self.budget_bytes,
+            "hits_total": self.hits,
+            "misses_total": self.misses,
+            "evictions_total": self.evictions,
+        }
@@ -0,0 +1,207 @@
+import os
+import re
+
+import numpy as np
+
+
+def locate_chunks(page_text, chunks):
+    """Character span of each chunk inside its page, ignoring whitespace differences.
+
+    Chunks are sentences re-joined with single spaces, so they are matched word by
+    word rather than as exact substrings. Unmatched chunks get (-1, -1).
+    """
+    spans = []
+    cursor = 0
+    for chunk in chunks:
+        words = chunk.split()
+        if not words:
+            spans.append((-1, -1))
+            continue
+        pattern = r"\s+".join(re.escape(word) for word in words)
+        match = re.compile(pattern).search(page_text, cursor)
+        if match:
+            spans.append(match.span())
+            cursor = match.end()
+        else:
+            spans.append((-1, -1))
+    return spans
+
+
+def _batched(name):
+    """Array attribute that folds pending appended batches in before it is read"""
+    private = "_" + name
+
+    def get(self):
+        self._flush()
+        return getattr(self, private)
+
+    def set(self, value):
+        setattr(self, private, value)
+
+    return property(get, set)
+
+
+class ChunkStore:
+    """Chunk texts in one contiguous UTF-8 buffer with numpy metadata, indexed by chunk id.
+
+    A chunk id is its position in the arrays. Removed chunks are tombstoned
+    (length -1) so ids stay stable for the FAISS index. Appended batches are
+    kept aside and concatenated once when the arrays are next read, so a
+    document streamed in many batches is not copied again for each one. The
+    arrays are written to disk as-is and memory-mapped on load.
+    """
+
+    ARRAYS = ("buffer", "offsets", "lengths", "pages", "starts", "ends")
+
+    __slots__ = tuple("_" + name for name in ARRAYS) + ("_pending", "_next_id", "_buffer_size")
+
+    buffer = _batched("buffer")
+    offsets = _batched("offsets")
+    lengths = _batched("lengths")
+    pages = _batched("pages")
+    starts = _batched("starts")
+    ends = _batched("ends")
+
+    def __init__(self):
+        self._set_arrays(
+            buffer=np.zeros(0, dtype=np.uint8),
+            offsets=np.zeros(0, dtype=np.int64),
+            lengths=np.zeros(0, dtype=np.int32),
+            pages=np.zeros(0, dtype=np.int32),
+            starts=np.zeros(0, dtype=np.int32),
+            ends=np.zeros(0, dtype=np.int32),
+        )
+
+    def _set_arrays(self, **arrays):
+        for name in self.ARRAYS:
+            setattr(self, "_" + name, arrays[name])
+        self._pending = []
+        self._next_id = len(self._offsets)
+        self._buffer_size = len(self._buffer)
+
+    def _flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        for position, name in enumerate(self.ARRAYS):
+            private = "_" + name
+            setattr(self, private, np.concatenate([getattr(self, private)] + [batch[position] for batch in pending]))
+
+    def __len__(self):
+        """Number of live chunks"""
+        return int(np.count_nonzero(self.lengths >= 0))
+
+    @property
+    def next_id(self):
+        return self._next_id
+
+    def append(self, texts, pages, spans=None):
+        """Append chunks and return their ids"""
+        if not texts:
+            return []
+        encoded = [text.encode("utf-8") for text in texts]
+        lengths = np.array([len(data) for data in encoded], dtype=np.int32)
+        offsets = self._buffer_size + np.concatenate(([0], np.cumsum(lengths[:-1], dtype=np.int64)))
+        spans = spans or [(-1, -1)] * len(texts)
+
+        first_id = self._next_id
+        self._pending.append((
+            np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            offsets.astype(np.int64),
+            lengths,
+            np.asarray(pages, dtype=np.int32),
+            np.array([s for s, _ in spans], dtype=np.int32),
+            np.array([e for _, e in spans], dtype=np.int32),
+        ))
+        self._next_id += len(texts)
+        self._buffer_size += int(lengths.sum())
+        return list(range(first_id, self._next_id))
+
+    def remove(self, ids):
+        self.lengths[np.asarray(ids, dtype=np.int64)] = -1
+
+    def view(self, chunk_id):
+        """Zero-copy view of a chunk's UTF-8 bytes"""
+        length = int(self.lengths[chunk_id])
+        if length < 0:
+            raise KeyError(chunk_id)
+        offset = int(self.offsets[chunk_id])
+        return memoryview(self.buffer)[offset:offset + length]
+
+    def __getitem__(self, chunk_id):
+        return bytes(self.view(chunk_id)).decode("utf-8")
+
+    def __contains__(self, chunk_id):
+        return 0 <= chunk_id < self.next_id and self.lengths[chunk_id] >= 0
+
+    def texts(self):
+        """Live chunk texts in id order"""
+        for chunk_id in np.flatnonzero(self.lengths >= 0):
+            yield self[int(chunk_id)]
+
+    def set_pages(self, ids, page):
+        self.pages[np.asarray(ids, dtype=np.int64)] = page
+
+    def copy(self):
+        store = ChunkStore.__new__(ChunkStore)
+        store._set_arrays(**{name: np.array(getattr(self, name)) for name in self.ARRAYS})
+        return store
+
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+    def save(self, directory):
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, f"chunks_{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory):
+        store = cls.__new__(cls)
+        store._set_arrays(**{
+            name: np.load(os.path.join(directory, f"chunks_{name}.npy"), mmap_mode="r") for name in cls.ARRAYS
+        })
+        return store
+
+    @classmethod
+    def from_mapping(cls, chunk_map):
+        """Build a store from an id -> text dict (indexes written before the chunk store existed)"""
+        store = cls()
+        size = max(chunk_map) + 1 if chunk_map else 0
+        texts = [chunk_map.get(chunk_id, "") for chunk_id in range(size)]
+        store.append(texts, [0] * size)
+        store.remove([chunk_id for chunk_id in range(size) if chunk_id not in chunk_map])
+        return store
+
+
+class ChunkResult:
+    """Search hit that decodes its chunk text only when read"""
+
+    __slots__ = ("store", "chunk_id", "score", "section")
+
+    def __init__(self, store, chunk_id, score, section=""):
+        self.store = store
+        self.chunk_id = chunk_id
+        self.score = score
+        self.section = section
+
+    @property
+    def chunk(self):
+        return self.store[self.chunk_id]
+
+    @property
+    def page(self):
+        return int(self.store.pages[self.chunk_id]) + 1
+
+    @property
+    def span(self):
+        return int(self.store.starts[self.chunk_id]), int(self.store.ends[self.chunk_id])
+
+    def __getitem__(self, key):
+        # Results used to be dicts; keep result['chunk'] / result['score'] working
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
@@ -0,0 +1,158 @@
+import json
+import os
+import re
+import sys
+import threading
+
+NOT_PRESENT_ANSWER = "This information is not present in the policy."
+
+STOPWORDS = {
+    "a", "an", "and", "any", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how",
+    "i", "in", "is", "it", "me", "my", "of", "on", "or", "policy", "the", "there", "this", "to", "under",
+    "what", "when", "which", "who", "will", "with",
+}
+
+
+def content_words(text):
+    return {word for word in re.findall(r"[a-z0-9]+", (text or "").lower()) if word not in STOPWORDS and len(word) > 2}
+
+
+def retrieval_features(user_query, parsed_query, results):
+    """Dense and lexical evidence that the retrieved chunks answer the query.
+
+    best_distance is the smallest L2 distance (lower is closer). lexical_overlap
+    is the share of the query's content words (the parsed entity's, if any)
+    found in any retrieved chunk.
+    """
+    terms = content_words((parsed_query or {}).get("entity")) or content_words(user_query)
+    chunk_words = set()
+    for result in results:
+        chunk_words |= content_words(result["chunk"])
+    return {
+        "best_distance": min((float(result["score"]) for result in results), default=float("inf")),
+        "lexical_overlap": len(terms & chunk_words) / len(terms) if terms else 1.0,
+    }
+
+
+class ConfidenceGate:
+    """Answers "not present" without an LLM call when retrieval found nothing relevant.
+
+    A question is skipped only if both signals are weak: the best distance is
+    above max_distance and the lexical overlap is below min_overlap. A
+    max_distance of 0 disables the gate.
+    """
+
+    def __init__(self, max_distance=0.0, min_overlap=0.5):
+        self.max_distance = max_distance
+        self.min_overlap = min_overlap
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.skipped = 0
+
+    @classmethod
+    def from_file(cls, path):
+        """Gate with the thresholds written by the calibration tool"""
+        with open(path, encoding="utf-8") as f:
+            calibration = json.load(f)
+        return cls(calibration["max_distance"], calibration["min_overlap"])
+
+    def predicts_skip(self, features):
+        return (
+            self.max_distance > 0
+            and features["best_distance"] > self.max_distance
+            and features["lexical_overlap"] < self.min_overlap
+        )
+
+    def should_skip(self, features):
+        skip = self.predicts_skip(features)
+        with self._lock:
+            self.checked += 1
+            self.skipped += skip
+        return skip
+
+    def metrics(self):
+        return {
+            "enabled": self.max_distance > 0,
+            "max_distance": self.max_distance,
+            "min_overlap": self.min_overlap,
+            "checked_total": self.checked,
+            "skipped_total": self.skipped,
+        }
+
+
+def evaluate(gate, samples):
+    """Precision of skipped answers (skipped questions that really were unanswerable) and coverage"""
+    skipped = [answerable for features, answerable in samples if gate.predicts_skip(features)]
+    unanswerable = sum(1 for _, answerable in samples if not answerable)
+    correct = sum(1 for answerable in skipped if not answerable)
+    return {
+        "questions": len(samples),
+        "unanswerable": unanswerable,
+        "skipped": len(skipped),
+        "skip_precision": correct / len(skipped) if skipped else 1.0,
+        "unanswerable_recall": correct / unanswerable if unanswerable else 0.0,
+        "skip_rate": len(skipped) / len(samples) if samples else 0.0,
+    }
+
+
+def calibrate(samples, target_precision=0.95, overlap_grid=(0.25, 0.5, 0.75, 1.01)):
+    """Thresholds that skip the most questions while skip precision stays at or above target_precision.
+
+    samples is a list of (features, answerable). Distance candidates are the
+    observed best distances, so the search is exhaustive over what was seen.
+    """
+    best = None
+    distances = sorted({features["best_distance"] for features, _ in samples if features["best_distance"] != float("inf")})
+    for min_overlap in overlap_grid:
+        for max_distance in distances:
+            report = evaluate(ConfidenceGate(max_distance, min_overlap), samples)
+            if report["skipped"] == 0 or report["skip_precision"] < target_precision:
+                continue
+            if best is None or report["skipped"] > best["report"]["skipped"]:
+                best = {"max_distance": max_distance, "min_overlap": min_overlap, "report": report}
+    return best
+
+
+# Usage: python clause-matcher/confidence_gate.py <labelled.jsonl> [target_precision] [output.json]
+# Each line: {"document": "<extracted text file>", "question": "...", "answerable": true}
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from main import SemanticSearch, PolicyQueryBot, parse_queries_locally, embed_search_queries
+
+    if len(sys.argv) < 2:
+        print("Usage: python clause-matcher/confidence_gate.py <labelled.jsonl> [target_precision] [output.json]")
+        sys.exit(1)
+
+    with open(sys.argv[1], encoding="utf-8") as f:
+        labelled = [json.loads(line) for line in f if line.strip()]
+    target_precision = float(sys.argv[2]) if len(sys.argv) > 2 else 0.95
+    output_path = sys.argv[3] if len(sys.argv) > 3 else None
+
+    samples = []
+    by_document = {}
+    for item in labelled:
+        by_document.setdefault(item["document"], []).append(item)
+    for document, items in by_document.items():
+        bot = PolicyQueryBot(search_engine=SemanticSearch(document), verbose=False)
+        questions = [item["question"] for item in items]
+        # Features come from the local parse, as in the API
+        parsed_queries = parse_queries_locally(questions)
+        batch_results = bot.retrieve(questions, parsed_queries, search_embeddings=embed_search_queries(questions, parsed_queries))
+        for item, parsed, results in zip(items, parsed_queries, batch_results):
+            samples.append((retrieval_features(item["question"], parsed, results), bool(item["answerable"])))
+
+    calibration = calibrate(samples, target_precision)
+    if calibration is None:
+        print(f"No threshold reaches {target_precision:.0%} skip precision on {len(samples)} questions")
+        sys.exit(1)
+    report = calibration["report"]
+    print(f"max_distance={calibration['max_distance']:.4f} min_overlap={calibration['min_overlap']}")
+    print(
+        f"Skips {report['skipped']} of {report['questions']} questions ({report['skip_rate']:.0%}), "
+        f"precision {report['skip_precision']:.1%}, catches {report['unanswerable_recall']:.0%} "
+        f"of {report['unanswerable']} unanswerable"
+    )
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(calibration, f, indent=2)
+        print(f"Wrote {output_path} (set CONFIDENCE_GATE_FILE to use it)")
@@ -0,0 +1,102 @@
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """Persistent content-hash -> embedding store shared by every document.
+
+    Policies from the same insurer repeat large blocks of boilerplate, so each
+    chunk text is embedded once per model and afterwards read back from SQLite.
+    Vectors are stored as float16 to halve the file size.
+    """
+
+    def __init__(self, db_path, model_key):
+        self.db_path = db_path
+        self.model_key = model_key
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        # WAL lets several worker processes read while one writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key BLOB PRIMARY KEY,"
+            " dim INTEGER NOT NULL,"
+            " vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _key(self, text):
+        # The model key is part of the hash so vectors from another model or version are never reused
+        return hashlib.sha256(f"{self.model_key}\0{text}".encode("utf-8")).digest()
+
+    def lookup(self, texts):
+        """Return {position: vector} for every text already in the cache"""
+        keys = [self._key(text) for text in texts]
+        positions = {}
+        for position, key in enumerate(keys):
+            positions.setdefault(key, []).append(position)
+
+        found = {}
+        unique_keys = list(positions)
+        with self._lock:
+            # Stay below SQLite's bound-parameter limit
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, dim, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, dim, vector in rows:
+                    embedding = np.frombuffer(vector, dtype=np.float16, count=dim).astype(np.float32)
+                    for position in positions[bytes(key)]:
+                        found[position] = embedding
+        return found
+
+    def store(self, texts, embeddings):
+        """Insert freshly computed embeddings"""
+        rows = [
+            (self._key(text), int(embedding.shape[0]), np.asarray(embedding, dtype=np.float16).tobytes())
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def encode(self, texts, encode_fn):
+        """Embed texts, calling encode_fn only for texts not seen before"""
+        texts = list(texts)
+        found = self.lookup(texts)
+        missing = [position for position in range(len(texts)) if position not in found]
+
+        # Embed each distinct missing text once, even if it repeats within the batch
+        missing_texts = list(dict.fromkeys(texts[position] for position in missing))
+        computed = {}
+        if missing_texts:
+            new_embeddings = np.asarray(encode_fn(missing_texts), dtype=np.float32)
+            self.store(missing_texts, new_embeddings)
+            computed = dict(zip(missing_texts, new_embeddings))
+
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([found[position] if position in found else computed[texts[position]]
+                         for position in range(len(texts))])
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
@@ -0,0 +1,140 @@
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+
+# Model owned by the embedding worker process (EMBEDDING_SERVICE=process)
+_worker_model = None
+
+
+def _load_worker_model(model_name):
+    global _worker_model
+    from sentence_transformers import SentenceTransformer
+    _worker_model = SentenceTransformer(model_name)
+
+
+def _encode_in_worker(texts, batch_size):
+    return _worker_model.encode(texts, batch_size=batch_size)
+
+
+def process_encoder(model_name, batch_size):
+    """encode_fn that runs the model in a separate local process.
+
+    The process is spawned rather than forked: forking after torch has started
+    its thread pools can deadlock the child.
+    """
+    executor = ProcessPoolExecutor(
+        max_workers=1,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_load_worker_model,
+        initargs=(model_name,),
+    )
+    return lambda texts: executor.submit(_encode_in_worker, texts, batch_size).result()
+
+
+class EmbeddingService:
+    """Collects encode calls from concurrent requests into shared micro-batches.
+
+    A batch is closed when it holds max_batch_size texts or max_wait_ms has
+    passed since its first call arrived, then encoded with one encode_fn call on
+    the service thread; each caller gets back the rows of its own texts. A call
+    larger than max_batch_size is queued one max_batch_size slice at a time, so
+    calls that arrive meanwhile are batched between its slices instead of
+    waiting for the whole call.
+    """
+
+    def __init__(self, encode_fn, max_batch_size=64, max_wait_ms=5):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._carry = None
+        self.batches = 0
+        self.calls = 0
+        self.texts = 0
+        self.queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+        self.encode_seconds = 0.0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+        self._thread.start()
+
+    def encode(self, texts):
+        """Embeddings of texts (blocks until the batch holding them is encoded)"""
+        texts = list(texts)
+        if not texts:
+            return self.encode_fn(texts)
+        parts = []
+        for start in range(0, len(texts), self.max_batch_size):
+            # The next slice goes to the back of the queue, behind calls queued while this one ran
+            future = Future()
+            self._queue.put((texts[start:start + self.max_batch_size], future, time.monotonic()))
+            parts.append(future.result())
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def _next_batch(self):
+        """Block for the first call, then gather more until the batch is full or the wait is over"""
+        first = self._carry or self._queue.get()
+        self._carry = None
+        batch = [first]
+        size = len(first[0])
+        closes_at = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = closes_at - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                call = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if size + len(call[0]) > self.max_batch_size:
+                # Starts the next batch instead of overfilling this one
+                self._carry = call
+                break
+            batch.append(call)
+            size += len(call[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started = time.monotonic()
+            texts = [text for call_texts, _, _ in batch for text in call_texts]
+            try:
+                vectors = np.asarray(self.encode_fn(texts))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.monotonic()
+
+            offset = 0
+            for call_texts, future, _ in batch:
+                future.set_result(vectors[offset:offset + len(call_texts)])
+                offset += len(call_texts)
+
+            with self._lock:
+                self.batches += 1
+                self.calls += len(batch)
+                self.texts += len(texts)
+                self.encode_seconds += finished - started
+                for _, _, enqueued in batch:
+                    self.queue_seconds += started - enqueued
+                    self.max_queue_seconds = max(self.max_queue_seconds, started - enqueued)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "calls": self.calls,
+                "texts": self.texts,
+                "queued_calls": self._queue.qsize(),
+                "mean_batch_texts": round(self.texts / self.batches, 2) if self.batches else 0.0,
+                "mean_batch_calls": round(self.calls / self.batches, 2) if self.batches else 0.0,
+                "mean_queue_ms": round(self.queue_seconds / self.calls * 1000, 2) if self.calls else 0.0,
+                "max_queue_ms": round(self.max_queue_seconds * 1000, 2),
+                "mean_encode_ms": round(self.encode_seconds / self.batches * 1000, 2) if self.batches else 0.0,
+            }
@@ -0,0 +1,52 @@
+import json
+import random
+import re
+import time
+
+from token_usage import estimate_tokens
+
+
+class FakeUsage:
+    def __init__(self, prompt, text):
+        self.prompt_token_count = estimate_tokens(prompt)
+        self.candidates_token_count = estimate_tokens(text)
+
+
+class FakeResponse:
+    def __init__(self, prompt, text):
+        self.text = text
+        self.usage_metadata = FakeUsage(prompt, text)
+
+
+class FakeGenerativeModel:
+    """Stand-in for GenerativeModel with Gemini-like latency and no network, for load tests.
+
+    Parse prompts get a JSON parse of the query; answer prompts get the first
+    sentence of the first retrieved clause. Each call sleeps latency_ms on
+    average (exponentially distributed above a floor of half of it).
+    """
+
+    def __init__(self, latency_ms=800):
+        self.latency_ms = latency_ms
+
+    def _sleep(self):
+        if self.latency_ms > 0:
+            half = self.latency_ms / 2000
+            time.sleep(half + random.expovariate(1 / half))
+
+    def generate_content(self, prompt):
+        self._sleep()
+        if "User Query:" in prompt:
+            query = prompt.rsplit("User Query:", 1)[1].strip()
+            text = json.dumps({
+                "intent": "coverage_check",
+                "entity": query.rstrip("?"),
+                "attributes": ["coverage"],
+                "context_type": "policy",
+                "output_format": "text",
+            })
+        else:
+            clauses = prompt.split("Relevant Policy Clauses:", 1)[-1].split("Instructions:", 1)[0].strip()
+            first = re.split(r"(?<=[.!?])\s", clauses, maxsplit=1)[0] if clauses else ""
+            text = first or "This information is not present in the policy."
+        return FakeResponse(prompt, text)
@@ -0,0 +1,203 @@
+import os
+import re
+import sqlite3
+import threading
+
+import faiss
+import numpy as np
+
+from sections import SECTION_HEADING
+
+METADATA_FIELDS = ("doc_id", "insurer", "policy_name", "version", "page", "section")
+
+
+def shard_name(insurer):
+    """File-system safe shard name for an insurer"""
+    return re.sub(r"[^a-z0-9]+", "-", (insurer or "").lower()).strip("-") or "default"
+
+
+class PolicyLibrary:
+    """Many ingested policies in one persistent, sharded index with per-chunk metadata.
+
+    Chunks are sharded by insurer. Metadata lives in SQLite next to the shards;
+    a metadata filter is resolved to chunk ids there and pushed into the FAISS
+    search as an ID selector, and an insurer filter skips other shards entirely.
+    """
+
+    def __init__(self, root, dim):
+        self.root = root
+        self.dim = dim
+        self.shard_dir = os.path.join(root, "shards")
+        os.makedirs(self.shard_dir, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._shards = {}
+        self._conn = sqlite3.connect(os.path.join(root, "library.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " id INTEGER PRIMARY KEY,"
+            " shard TEXT NOT NULL,"
+            " doc_id TEXT NOT NULL,"
+            " insurer TEXT,"
+            " policy_name TEXT,"
+            " version TEXT,"
+            " page INTEGER,"
+            " section TEXT,"
+            " text TEXT NOT NULL)"
+        )
+        for field in ("doc_id", "insurer", "policy_name", "shard"):
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS chunks_{field} ON chunks ({field})")
+        self._conn.commit()
+
+    def _shard(self, name):
+        """Load a shard index on first use, or start an empty one"""
+        if name not in self._shards:
+            path = os.path.join(self.shard_dir, f"{name}.faiss")
+            if os.path.exists(path):
+                self._shards[name] = faiss.read_index(path)
+            else:
+                self._shards[name] = faiss.IndexIDMap2(faiss.IndexFlatL2(self.dim))
+        return self._shards[name]
+
+    def _save_shard(self, name):
+        # Write then rename so a crash never leaves a truncated shard behind
+        path = os.path.join(self.shard_dir, f"{name}.faiss")
+        faiss.write_index(self._shards[name], path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    def add_document(self, doc_id, page_texts, chunk_fn, encode_fn, insurer="", policy_name="", version=""):
+        """Chunk, embed and add a policy; an existing document with the same id is replaced"""
+        rows = []
+        for page_number, page_text in enumerate(page_texts, start=1):
+            section = ""
+            for chunk in chunk_fn(page_text):
+                headings = SECTION_HEADING.findall(chunk)
+                if headings:
+                    section = headings[-1].strip()
+                rows.append((page_number, section, chunk))
+        if not rows:
+            return 0
+
+        embeddings = np.asarray(encode_fn([text for _, _, text in rows]), dtype="float32")
+        name = shard_name(insurer)
+
+        with self._lock:
+            self.remove_document(doc_id)
+            next_id = self._conn.execute("SELECT COALESCE(MAX(id), -1) + 1 FROM chunks").fetchone()[0]
+            ids = np.arange(next_id, next_id + len(rows), dtype="int64")
+
+            self._shard(name).add_with_ids(embeddings, ids)
+            self._conn.executemany(
+                "INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (int(chunk_id), name, doc_id, insurer, policy_name, version, page, section, text)
+                    for chunk_id, (page, section, text) in zip(ids, rows)
+                ],
+            )
+            self._conn.commit()
+            self._save_shard(name)
+        return len(rows)
+
+    def remove_document(self, doc_id):
+        """Remove every chunk of a document by id"""
+        with self._lock:
+            by_shard = {}
+            for chunk_id, name in self._conn.execute("SELECT id, shard FROM chunks WHERE doc_id = ?", (doc_id,)):
+                by_shard.setdefault(name, []).append(chunk_id)
+            if not by_shard:
+                return 0
+
+            for name, ids in by_shard.items():
+                self._shard(name).remove_ids(np.array(ids, dtype="int64"))
+                self._save_shard(name)
+            self._conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+            self._conn.commit()
+            return sum(len(ids) for ids in by_shard.values())
+
+    def _where(self, filters):
+        """SQL WHERE clause for a filter dict; values may be a single value or a list"""
+        clauses = []
+        params = []
+        for field, value in (filters or {}).items():
+            if field not in METADATA_FIELDS:
+                raise ValueError(f"Unknown metadata field: {field}")
+            values = value if isinstance(value, (list, tuple)) else [value]
+            clauses.append(f"{field} IN ({','.join('?' * len(values))})")
+            params.extend(values)
+        return (" AND ".join(clauses) or "1"), params
+
+    def search(self, query_embeddings, top_k=5, filters=None):
+        """Search all matching shards for every query and merge results by distance"""
+        query_embeddings = np.asarray(query_embeddings, dtype="float32")
+        filters = dict(filters or {})
+        where, params = self._where(filters)
+
+        with self._lock:
+            shard_names = [
+                row[0] for row in self._conn.execute(f"SELECT DISTINCT shard FROM chunks WHERE {where}", params)
+            ]
+            # An insurer-only filter is fully handled by choosing shards
+            needs_selector = any(field != "insurer" for field in filters)
+
+            merged = [[] for _ in range(len(query_embeddings))]
+            for name in shard_names:
+                index = self._shard(name)
+                if index.ntotal == 0:
+                    continue
+                params_for_search = None
+                if needs_selector:
+                    ids = np.array(
+                        [row[0] for row in self._conn.execute(
+                            f"SELECT id FROM chunks WHERE shard = ? AND {where}", [name] + params
+                        )],
+                        dtype="int64",
+                    )
+                    if len(ids) == 0:
+                        continue
+                    params_for_search = faiss.SearchParameters(sel=faiss.IDSelectorBatch(ids))
+                distances, indices = index.search(query_embeddings, top_k, params=params_for_search)
+                for row in range(len(query_embeddings)):
+                    merged[row].extend(
+                        (float(distance), int(idx)) for distance, idx in zip(distances[row], indices[row]) if idx >= 0
+                    )
+
+            batch_results = []
+            for hits in merged:
+                hits = sorted(hits)[:top_k]
+                metadata = self._metadata([idx for _, idx in hits])
+                batch_results.append([dict(metadata[idx], score=distance) for distance, idx in hits])
+            return batch_results
+
+    def _metadata(self, ids):
+        if not ids:
+            return {}
+        rows = self._conn.execute(
+            f"SELECT id, doc_id, insurer, policy_name, version, page, section, text FROM chunks"
+            f" WHERE id IN ({','.join('?' * len(ids))})",
+            ids,
+        ).fetchall()
+        return {
+            row[0]: {
+                "doc_id": row[1],
+                "insurer": row[2],
+                "policy_name": row[3],
+                "version": row[4],
+                "page": row[5],
+                "section": row[6],
+                "chunk": row[7],
+            }
+            for row in rows
+        }
+
+    def documents(self):
+        """List ingested documents with their chunk counts"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_id, insurer, policy_name, version, COUNT(*) FROM chunks"
+                " GROUP BY doc_id, insurer, policy_name, version ORDER BY insurer, policy_name"
+            ).fetchall()
+        return [
+            {"doc_id": r[0], "insurer": r[1], "policy_name": r[2], "version": r[3], "chunks": r[4]}
+            for r in rows
+        ]
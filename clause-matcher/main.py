@@ -1,75 +1,358 @@
 import json
 import os
 import sys
+import threading
+import time
 from google.generativeai import GenerativeModel
 import google.generativeai as genai
 from dotenv import load_dotenv
 import nltk
 from nltk.tokenize import sent_tokenize
+import sentence_transformers
 from sentence_transformers import SentenceTransformer
-import faiss
 import numpy as np
 
 # Load environment variables
 load_dotenv()
 
+# "gemini", or "fake" for load tests (canned replies with simulated latency, no API key needed)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "800"))
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-1.5-flash")
+# Used instead of LLM_MODEL when a submission is about to miss its deadline
+FAST_LLM_MODEL = os.getenv("FAST_LLM_MODEL", "gemini-1.5-flash-8b")
+
 # Configure Gemini API
 api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("GEMINI_API_KEY not found in environment variables")
-
-genai.configure(api_key=api_key)
+if LLM_BACKEND == "gemini":
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY not found in environment variables")
+    genai.configure(api_key=api_key)
 
 # Download required NLTK data
 nltk.download('punkt_tab')
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from page_index import PageIndex, split_pages, hash_text
+from chunk_store import ChunkResult
+from embedding_cache import EmbeddingCache
+from library import PolicyLibrary
+from token_usage import TokenUsage, response_usage, adaptive_k, within_token_budget
+from text_cleaning import BOILERPLATE_MIN_PAGES, clean_pages, merge_reports, describe_report
+from fake_llm import FakeGenerativeModel
+from confidence_gate import ConfidenceGate, NOT_PRESENT_ANSWER, retrieval_features
+from embedding_service import EmbeddingService, process_encoder
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'llm-parser'))
+from local_parser import LocalQueryParser, expand_query, prefer_section
+from extractive import extract_answer
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Chunk embeddings shared across documents; set EMBEDDING_CACHE_PATH to an empty value to disable
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "embedding_cache.sqlite3")
+)
+_embedding_cache = None
+_embedding_model = None
+# Lazy process-wide objects are built once even when the first calls race on the stage threads
+_embedding_cache_lock = threading.Lock()
+_embedding_model_lock = threading.Lock()
+
+# Encode calls of concurrent requests are merged into micro-batches of up to EMBED_MAX_BATCH texts,
+# waiting at most EMBED_MAX_WAIT_MS for company: "thread" (in-process), "process" (model in a
+# separate local process) or "off" (every caller encodes on its own)
+EMBEDDING_SERVICE = os.getenv("EMBEDDING_SERVICE", "thread")
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "64"))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+_embedding_service = None
+_embedding_service_lock = threading.Lock()
+
+def get_llm_model(fast=False):
+    """Gemini model (the faster one if fast), or the fake backend when LLM_BACKEND=fake"""
+    if LLM_BACKEND == "fake":
+        return FakeGenerativeModel(FAKE_LLM_LATENCY_MS / 2 if fast else FAKE_LLM_LATENCY_MS)
+    return GenerativeModel(FAST_LLM_MODEL if fast else LLM_MODEL)
+
+def get_embedding_model():
+    """Load the sentence embedding model once per process"""
+    global _embedding_model
+    if _embedding_model is None:
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                _embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    return _embedding_model
+
+def get_embedding_service():
+    """Start the shared micro-batching encoder on first use (None when EMBEDDING_SERVICE=off)"""
+    global _embedding_service
+    if _embedding_service is None and EMBEDDING_SERVICE != "off":
+        with _embedding_service_lock:
+            if _embedding_service is None:
+                if EMBEDDING_SERVICE == "process":
+                    encode_fn = process_encoder(EMBEDDING_MODEL_NAME, EMBED_MAX_BATCH)
+                else:
+                    model = get_embedding_model()
+                    encode_fn = lambda texts: model.encode(texts, batch_size=EMBED_MAX_BATCH)
+                _embedding_service = EmbeddingService(encode_fn, EMBED_MAX_BATCH, EMBED_MAX_WAIT_MS)
+    return _embedding_service
+
+def embedding_cache_metrics():
+    """Hits, misses and hit rate of the chunk embedding cache (None when disabled or not yet opened)"""
+    return _embedding_cache.stats() if _embedding_cache is not None else None
+
+def embedding_metrics():
+    """Micro-batch sizes and queue latency of the embedding service (None before it has started)"""
+    return _embedding_service.metrics() if _embedding_service is not None else None
+
+def embed_texts(texts):
+    """Embed texts, sharing encoder batches with concurrent callers"""
+    service = get_embedding_service()
+    if service is None:
+        return get_embedding_model().encode(list(texts))
+    return service.encode(texts)
+
+def split_into_chunks(text, max_sentences=3):
+    """Split text into chunks of sentences"""
+    sentences = sent_tokenize(text)
+    return [' '.join(sentences[i:i+max_sentences]) for i in range(0, len(sentences), max_sentences)]
+
+def encode_chunks(chunks):
+    """Embed chunk texts, reusing cached vectors for text seen in any earlier document"""
+    cache = get_embedding_cache()
+    if cache is None:
+        return embed_texts(chunks)
+    return cache.encode(chunks, embed_texts)
+
+# Stored vector compression for new indexes: "none" (float32), "fp16" or "int8", optionally after PCA
+VECTOR_COMPRESSION = os.getenv("VECTOR_COMPRESSION", "none")
+VECTOR_PCA_DIM = int(os.getenv("VECTOR_PCA_DIM", "0"))
+# Compressed indexes fetch top_k * RESCORE_FACTOR candidates and re-rank them with exact vectors
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", "4"))
+
+# Strip repeated headers/footers, page numbers and whitespace noise from pages before chunking
+CLEAN_TEXT = os.getenv("CLEAN_TEXT", "1") != "0"
+# Also count chunks of the raw pages in the cleaning report (tokenizes every page once more; off by default)
+CLEANING_REPORT_CHUNKS = os.getenv("CLEANING_REPORT_CHUNKS", "0") != "0"
+
+# Retrieval keeps between MIN_TOP_K and top_k chunks per question, fewer when one result clearly
+# dominates the score gap (ADAPTIVE_TOP_K=0 always keeps top_k), within CONTEXT_TOKEN_BUDGET tokens
+ADAPTIVE_TOP_K = os.getenv("ADAPTIVE_TOP_K", "1") != "0"
+MIN_TOP_K = int(os.getenv("MIN_TOP_K", "2"))
+MAX_TOP_K = int(os.getenv("MAX_TOP_K", "8"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+
+# Prompt/completion tokens of every Gemini call in this process, by kind
+token_usage = TokenUsage()
+
+# Long documents are searched coarse-to-fine: queries are matched to section centroids first and only
+# chunks of the SECTION_PROBE closest sections are scored (HIERARCHICAL_MIN_CHUNKS=0 disables it)
+HIERARCHICAL_MIN_CHUNKS = int(os.getenv("HIERARCHICAL_MIN_CHUNKS", "1000"))
+SECTION_PROBE = int(os.getenv("SECTION_PROBE", "4"))
+
+# Answer "not present" without a Gemini call when retrieval is weak; fit the thresholds with
+# python clause-matcher/confidence_gate.py (GATE_MAX_DISTANCE=0 disables the gate)
+CONFIDENCE_GATE_FILE = os.getenv("CONFIDENCE_GATE_FILE", "")
+confidence_gate = (
+    ConfidenceGate.from_file(CONFIDENCE_GATE_FILE) if CONFIDENCE_GATE_FILE
+    else ConfidenceGate(float(os.getenv("GATE_MAX_DISTANCE", "0")), float(os.getenv("GATE_MIN_OVERLAP", "0.5")))
+)
+
+# Definition and numeric lookups are answered with the matching clause itself when extraction is
+# at least this confident (EXTRACTIVE_ANSWERS=0 sends every question to the LLM)
+EXTRACTIVE_ANSWERS = os.getenv("EXTRACTIVE_ANSWERS", "1") != "0"
+EXTRACTIVE_MIN_CONFIDENCE = float(os.getenv("EXTRACTIVE_MIN_CONFIDENCE", "0.8"))
+
+# Local parses below this confidence fall back to parse_query_with_gemini
+LOCAL_PARSER_MIN_CONFIDENCE = float(os.getenv("LOCAL_PARSER_MIN_CONFIDENCE", "0.6"))
+_query_parser = None
+_query_parser_lock = threading.Lock()
+
+def get_query_parser():
+    """Build the local query parser (intent prototypes are embedded once per process)"""
+    global _query_parser
+    if _query_parser is None:
+        with _query_parser_lock:
+            if _query_parser is None:
+                _query_parser = LocalQueryParser(embed_texts)
+    return _query_parser
+
+def get_embedding_cache():
+    """Open the process-wide chunk embedding cache on first use"""
+    global _embedding_cache
+    if _embedding_cache is None and EMBEDDING_CACHE_PATH:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                # The library version is part of the key so an upgrade never serves stale vectors
+                model_key = f"{EMBEDDING_MODEL_NAME}@sentence-transformers-{sentence_transformers.__version__}"
+                _embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, model_key)
+    return _embedding_cache
+
+def clean_document_pages(text):
+    """Pages of an extracted document, cleaned when CLEAN_TEXT is on; returns (pages, cleaning report or None)"""
+    pages = split_pages(text)
+    if not CLEAN_TEXT:
+        return pages, None
+    chunk_fn = split_into_chunks if CLEANING_REPORT_CHUNKS else None
+    pages, _, report = clean_pages(pages, chunk_fn=chunk_fn)
+    return pages, report
+
 class SemanticSearch:
-    def __init__(self, text_file_path):
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
-        self.chunks = []
-        self.index = None
-        self.chunk_map = {}
-        self.load_and_process_text(text_file_path)
-    
-    def load_and_process_text(self, text_file_path):
+    def __init__(self, text_file_path=None, page_hashes=None, page_index=None, text=None):
+        self.model = get_embedding_model()
+        self.page_index = page_index
+        self.cleaning_report = {}
+        if text is not None:
+            self.process_text(text, page_hashes)
+        elif page_index is None:
+            self.load_and_process_text(text_file_path, page_hashes)
+
+    # The live index is swapped as a single reference, so readers always see one consistent version
+    @property
+    def index(self):
+        return self.page_index.index
+
+    @property
+    def chunk_map(self):
+        return self.page_index.chunk_store
+
+    @property
+    def chunks(self):
+        return list(self.page_index.chunk_store.texts())
+    
+    def load_and_process_text(self, text_file_path, page_hashes=None):
         """Load text from file and create chunks"""
         with open(text_file_path, 'r', encoding='utf-8') as f:
             text = f.read()
+        self.process_text(text, page_hashes)
+    
+    def process_text(self, text, page_hashes=None):
+        """Chunk, embed and index already extracted text"""
+        # Chunk page by page so a changed page can later be re-embedded on its own
+        pages = split_pages(text)
+        if page_hashes is None or len(page_hashes) != len(pages):
+            page_hashes = [hash_text(page) for page in pages]
         
-        # Split into chunks of 3 sentences
-        self.chunks = self.split_into_chunks(text, max_sentences=3)
-        
-        # Create embeddings
-        chunk_embeddings = self.model.encode(self.chunks)
-        
-        # Build FAISS index
-        self.index = faiss.IndexFlatL2(chunk_embeddings.shape[1])
-        self.index.add(np.array(chunk_embeddings))
+        # Split into chunks of 3 sentences, embed and build the FAISS index
+        self.page_index = self.empty_page_index()
+        self.add_pages(pages, page_hashes)
+        if self.cleaning_report:
+            print(describe_report(self.cleaning_report))
+    
+    @staticmethod
+    def empty_page_index():
+        """PageIndex with the configured embedding model and vector compression, and no pages yet"""
+        return PageIndex(
+            get_embedding_model().get_sentence_embedding_dimension(),
+            EMBEDDING_MODEL_NAME,
+            compression=VECTOR_COMPRESSION,
+            pca_dim=VECTOR_PCA_DIM,
+            rescore_factor=RESCORE_FACTOR,
+        )
+    
+    def add_pages(self, page_texts, page_hashes, page_headings=None):
+        """Chunk, embed and append pages (called batch by batch while a PDF is still being extracted)"""
+        first_page = len(self.page_index.page_hashes)
+        page_texts = self.clean_pages(page_texts, range(first_page, first_page + len(page_texts)))
+        first_id = self.page_index.next_id
+        self.page_index.add_pages(page_texts, page_hashes, self.split_into_chunks, self.encode_chunks, page_headings)
+        self.count_cleaned_chunks(self.page_index.next_id - first_id)
+    
+    def update_pages(self, page_hashes, extract_pages, changed_headings=None):
+        """Re-embed only pages whose hash changed; extract_pages(page_numbers) -> {page_number: text}"""
+        _, changed = self.page_index.plan_update(page_hashes)
+        if not changed and len(page_hashes) == len(self.page_index.page_hashes):
+            return []
         
-        # Create chunk mapping
-        self.chunk_map = {i: chunk for i, chunk in enumerate(self.chunks)}
+        changed_texts = extract_pages(changed) if changed else {}
+        changed_texts = dict(zip(changed_texts, self.clean_pages(list(changed_texts.values()), list(changed_texts))))
+        first_id = self.page_index.next_id
+        self.page_index = self.page_index.updated(
+            page_hashes, changed_texts, self.split_into_chunks, self.encode_chunks, changed_headings
+        )
+        self.count_cleaned_chunks(self.page_index.next_id - first_id)
+        return changed
+    
+    def clean_pages(self, page_texts, page_numbers=None):
+        """Strip boilerplate learned from the document's first pages and add to the cleaning report"""
+        if not CLEAN_TEXT or not page_texts:
+            return page_texts
+        page_index = self.page_index
+        chunk_fn = self.split_into_chunks if CLEANING_REPORT_CHUNKS else None
+        cleaned, boilerplate, report = clean_pages(page_texts, page_index.boilerplate, chunk_fn, page_numbers)
+        if page_index.boilerplate is None and len(page_texts) >= BOILERPLATE_MIN_PAGES:
+            page_index.boilerplate = boilerplate
+        merge_reports(self.cleaning_report, report)
+        return cleaned
+    
+    def count_cleaned_chunks(self, chunk_count):
+        """Chunks produced from cleaned pages, counted from the chunking that indexing does anyway"""
+        if CLEAN_TEXT and self.cleaning_report:
+            merge_reports(self.cleaning_report, {"chunks_after": chunk_count})
+    
+    def encode_chunks(self, chunks):
+        """Embed chunk texts, reusing cached vectors for text seen in any earlier document"""
+        return encode_chunks(chunks)
     
     def split_into_chunks(self, text, max_sentences=3):
         """Split text into chunks of sentences"""
-        sentences = sent_tokenize(text)
-        return [' '.join(sentences[i:i+max_sentences]) for i in range(0, len(sentences), max_sentences)]
+        return split_into_chunks(text, max_sentences)
     
     def search_relevant_chunks(self, query, top_k=5):
         """Search for relevant chunks based on query"""
-        query_embedding = self.model.encode([query])
-        distances, indices = self.index.search(np.array(query_embedding), top_k)
+        return self.search_batch([query], top_k=top_k)[0]
+    
+    def search_batch(self, queries, top_k=5):
+        """Search for all queries with one encoder pass and one multi-query FAISS search"""
+        if not queries:
+            return []
+        return self.search_by_embeddings(embed_texts(queries), top_k=top_k)
+    
+    def search_by_embeddings(self, query_embeddings, top_k=5):
+        """Multi-query FAISS search for already embedded queries"""
+        page_index = self.page_index
+        hierarchical = HIERARCHICAL_MIN_CHUNKS and page_index.index.ntotal >= HIERARCHICAL_MIN_CHUNKS
+        distances, indices = page_index.search(
+            np.array(query_embeddings, dtype='float32'), top_k, section_probe=SECTION_PROBE if hierarchical else 0
+        )
         
-        results = []
-        for i, idx in enumerate(indices[0]):
-            results.append({
-                'chunk': self.chunk_map[idx],
-                'score': float(distances[0][i])
-            })
-        return results
+        batch_results = []
+        for row in range(len(query_embeddings)):
+            results = []
+            for i, idx in enumerate(indices[row]):
+                if idx < 0:
+                    # FAISS pads with -1 when the index holds fewer than top_k chunks
+                    continue
+                results.append(ChunkResult(
+                    page_index.chunk_store, int(idx), float(distances[row][i]), page_index.section_path(idx)
+                ))
+            batch_results.append(results)
+        return batch_results
+
+class LibrarySearch:
+    """Search over a PolicyLibrary with a fixed metadata filter, usable in place of SemanticSearch"""
+    def __init__(self, library, filters=None):
+        self.model = get_embedding_model()
+        self.library = library
+        self.filters = filters or {}
+    
+    def search_relevant_chunks(self, query, top_k=5):
+        """Search for relevant chunks based on query"""
+        return self.search_batch([query], top_k=top_k)[0]
+    
+    def search_batch(self, queries, top_k=5):
+        """Search for all queries with one encoder pass; the filter is applied inside the index search"""
+        if not queries:
+            return []
+        return self.search_by_embeddings(embed_texts(queries), top_k=top_k)
+    
+    def search_by_embeddings(self, query_embeddings, top_k=5):
+        """Filtered library search for already embedded queries"""
+        return self.library.search(query_embeddings, top_k=top_k, filters=self.filters)
 
 def parse_query_with_gemini(user_query):
     """Simple query parsing function"""
-    model = GenerativeModel("gemini-1.5-flash")
+    model = get_llm_model()
     system_prompt = """
 You are an intelligent parser. Convert the user's natural language query about a policy document into a structured JSON.
 
@@ -87,39 +370,169 @@ Only return a valid JSON object.
 
     try:
         response = model.generate_content(full_prompt)
+        token_usage.record("parse", response_usage(response, full_prompt, response.text))
         return response.text
     except Exception as e:
         return f'{{"error": "API Error", "message": "{str(e)}"}}'
 
+def parse_llm_json(text):
+    """Parse the JSON object in a Gemini reply, tolerating markdown code fences"""
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        return None
+    try:
+        parsed = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(parsed, dict) or "error" in parsed:
+        return None
+    # Multi-subject questions can come back with list entities or null fields
+    parsed["intent"] = _as_text(parsed.get("intent"))
+    parsed["entity"] = _as_text(parsed.get("entity"))
+    attributes = parsed.get("attributes")
+    if not isinstance(attributes, list):
+        attributes = [attributes]
+    parsed["attributes"] = [text for text in map(_as_text, attributes) if text]
+    return parsed
+
+def _as_text(value):
+    """A parsed JSON field as one string (lists joined, null as empty)"""
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return " ".join(filter(None, map(_as_text, value)))
+    return str(value)
+
+# Query-side steps; they need no document, so the API runs them while the document is still loading
+
+def parse_queries_locally(user_queries, query_embeddings=None):
+    """Local intent/entity parse of every query (one encoder pass if embeddings are not given)"""
+    return get_query_parser().parse_batch(list(user_queries), query_embeddings)
+
+def refine_parse(user_query, parsed):
+    """Re-parse a low-confidence local parse with Gemini, keeping the local parse if that fails"""
+    if parsed["confidence"] >= LOCAL_PARSER_MIN_CONFIDENCE:
+        return parsed
+    llm_parsed = parse_llm_json(parse_query_with_gemini(user_query))
+    if llm_parsed is None:
+        return parsed
+    llm_parsed["source"] = "llm"
+    return llm_parsed
+
+def embed_search_queries(user_queries, parsed_queries):
+    """Embed the entity-expanded retrieval queries"""
+    search_queries = [expand_query(q, parsed) for q, parsed in zip(user_queries, parsed_queries)]
+    return embed_texts(search_queries)
+
+def select_results(batch_results, parsed_queries, top_k=5):
+    """Cut over-fetched results to top_k, preferring the section each intent points at"""
+    return [prefer_section(results, parsed, top_k) for results, parsed in zip(batch_results, parsed_queries)]
+
+def fit_context(results, top_k):
+    """Adaptive k from the score gap, then cut to the prompt token budget"""
+    if ADAPTIVE_TOP_K:
+        results = results[:adaptive_k(results, min(MIN_TOP_K, top_k), top_k)]
+    if CONTEXT_TOKEN_BUDGET:
+        results = within_token_budget(results, CONTEXT_TOKEN_BUDGET)
+    return results
+
 class PolicyQueryBot:
-    def __init__(self, text_file_path, verbose=True):
-        self.search_engine = SemanticSearch(text_file_path)
-        self.model = GenerativeModel("gemini-1.5-flash")
+    def __init__(self, text_file_path=None, verbose=True, search_engine=None):
+        self.search_engine = search_engine or SemanticSearch(text_file_path)
+        self.model = get_llm_model()
+        self.fast_model = None
         self.verbose = verbose
     
-    def get_final_answer(self, user_query):
+    def parse_queries(self, user_queries, query_embeddings=None):
+        """Parse queries locally; only low-confidence ones go to Gemini"""
+        parsed_queries = parse_queries_locally(user_queries, query_embeddings)
+        return [refine_parse(q, parsed) for q, parsed in zip(user_queries, parsed_queries)]
+    
+    def retrieve(self, user_queries, parsed_queries, top_k=None, search_embeddings=None, rerank=True):
+        """Search with entity-expanded queries, preferring chunks from the section the intent points at"""
+        if not user_queries:
+            return []
+        if top_k is None:
+            top_k = MAX_TOP_K if ADAPTIVE_TOP_K else 5
+        if search_embeddings is None:
+            search_embeddings = embed_search_queries(user_queries, parsed_queries)
+        if not rerank:
+            # Plain vector ranking, for submissions short on time
+            batch_results = self.search_engine.search_by_embeddings(search_embeddings, top_k=top_k)
+            return [fit_context(results, top_k) for results in batch_results]
+        # Over-fetch so the section preference has candidates to choose from
+        batch_results = self.search_engine.search_by_embeddings(search_embeddings, top_k=top_k * 2)
+        return [fit_context(results, top_k) for results in select_results(batch_results, parsed_queries, top_k)]
+    
+    def prepare(self, user_queries, top_k=None):
+        """Parse and retrieve for every query in one batch; returns (parsed_queries, batch_results)"""
+        user_queries = list(user_queries)
+        if not user_queries:
+            return [], []
+        query_embeddings = embed_texts(user_queries)
+        parsed_queries = self.parse_queries(user_queries, query_embeddings)
+        return parsed_queries, self.retrieve(user_queries, parsed_queries, top_k=top_k)
+    
+    def get_final_answers(self, user_queries, top_k=None):
+        """Answer every query of a request, retrieving context for all of them in one batch"""
+        user_queries = list(user_queries)
+        parsed_queries, batch_results = self.prepare(user_queries, top_k=top_k)
+        return [
+            self.get_final_answer(user_query, relevant_results=relevant_results, parsed_query=parsed)
+            for user_query, relevant_results, parsed in zip(user_queries, batch_results, parsed_queries)
+        ]
+    
+    def get_final_answer(self, user_query, relevant_results=None, parsed_query=None):
         """Get complete answer for user query"""
+        return self.answer_with_usage(user_query, relevant_results, parsed_query)[0]
+    
+    def answer_with_usage(self, user_query, relevant_results=None, parsed_query=None, fast=False):
+        """Answer a query; returns (answer text, tokens of the answer call and number of chunks used)
+
+        fast answers with FAST_LLM_MODEL, for submissions about to miss their deadline.
+        """
         if self.verbose:
             print(f"Processing query: {user_query}")
             print("=" * 60)
         
-        # Step 1: Parse query with Gemini
-        parsed_query_raw = parse_query_with_gemini(user_query)
+        # Step 1: Parse query locally (Gemini only for low-confidence queries)
+        if parsed_query is None:
+            parsed_query = self.parse_queries([user_query])[0]
+        parsed_query_raw = json.dumps(parsed_query)
         if self.verbose:
             print(f"Parsed Query: {parsed_query_raw}")
             print("-" * 40)
         
-        # Step 2: Get relevant chunks from semantic search
-        relevant_results = self.search_engine.search_relevant_chunks(user_query, top_k=5)
+        # Step 2: Get relevant chunks from semantic search (unless already retrieved in a batch)
+        if relevant_results is None:
+            relevant_results = self.retrieve([user_query], [parsed_query])[0]
+        
+        # Nothing relevant retrieved - the model would only say so
+        if confidence_gate.should_skip(retrieval_features(user_query, parsed_query, relevant_results)):
+            if self.verbose:
+                print("Retrieval confidence too low, skipping the LLM")
+            return NOT_PRESENT_ANSWER, {"prompt_tokens": 0, "completion_tokens": 0, "chunks": 0}
+        
+        # Definition/numeric lookups: quote the clause when it is found with confidence
+        if EXTRACTIVE_ANSWERS:
+            extracted, confidence = extract_answer(parsed_query, relevant_results)
+            if extracted and confidence >= EXTRACTIVE_MIN_CONFIDENCE:
+                if self.verbose:
+                    print(f"Extractive answer (confidence {confidence:.2f}): {extracted}")
+                token_usage.record("extractive", {"prompt_tokens": 0, "completion_tokens": 0})
+                return extracted, {"prompt_tokens": 0, "completion_tokens": 0, "chunks": len(relevant_results)}
         
-        # Extract just the text chunks
-        top_matches = [result['chunk'] for result in relevant_results]
+        # Extract the text chunks, labelled with the section they come from
+        top_matches = [
+            f"[{result.get('section')}]\n{result['chunk']}" if result.get('section') else result['chunk']
+            for result in relevant_results
+        ]
         relevant_chunks = "\n\n".join(top_matches)
         
         if self.verbose:
             print("Found relevant policy sections:")
             for i, result in enumerate(relevant_results, 1):
-                print(f"{i}. Score: {result['score']:.4f}")
+                print(f"{i}. Score: {result['score']:.4f} (page {result.get('page', '?')})")
                 print(f"   {result['chunk'][:100]}...")
             print("-" * 40)
         
@@ -139,7 +552,7 @@ Relevant Policy Clauses:
 Instructions:
 - Answer only based on the provided text.
 - If coverage is conditional (e.g., waiting period), explain it clearly.
-- If not found, say "This information is not present in the policy."
+- If not found, say "{NOT_PRESENT_ANSWER}"
 - Be specific about any exclusions, waiting periods, or conditions.
 - Keep the answer concise but complete.
 
@@ -147,16 +560,24 @@ Answer:
 """
         
         try:
-            response = self.model.generate_content(final_prompt)
+            if fast and self.fast_model is None:
+                self.fast_model = get_llm_model(fast=True)
+            started = time.monotonic()
+            response = (self.fast_model if fast else self.model).generate_content(final_prompt)
+            seconds = time.monotonic() - started
+            usage = response_usage(response, final_prompt, response.text)
+            token_usage.record("answer", usage, seconds)
             if self.verbose:
                 print("FINAL ANSWER:")
                 print("=" * 60)
                 print(response.text)
-            return response.text
+                print(f"Tokens: {usage['prompt_tokens']} prompt, {usage['completion_tokens']} completion")
+            return response.text, dict(usage, chunks=len(relevant_results))
         except Exception as e:
             if self.verbose:
                 print(f"Error generating response: {e}")
-            return "Sorry, I couldn't generate a response due to an API error."
+            usage = {"prompt_tokens": 0, "completion_tokens": 0, "chunks": len(relevant_results)}
+            return "Sorry, I couldn't generate a response due to an API error.", usage
 
 # Only run tests if this file is executed directly
 if __name__ == "__main__":
@@ -0,0 +1,344 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import faiss
+import numpy as np
+
+from chunk_store import ChunkStore, locate_chunks
+from quantization import build_vector_index, usable_pca_dim, is_exact, rescore, index_memory_bytes
+from sections import SectionIndex
+
+PAGE_DELIMITER = "\x0c"  # written by extract_from_pdf after every page
+
+
+def split_pages(text):
+    """Split extracted text into pages using the form-feed page delimiter"""
+    pages = text.split(PAGE_DELIMITER)
+    # extract_from_pdf terminates the last page with a delimiter too
+    if len(pages) > 1 and pages[-1] == "":
+        pages = pages[:-1]
+    return pages
+
+
+def hash_text(text):
+    """Content hash used for pages that only exist as extracted text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class PageIndex:
+    """FAISS index whose chunks are grouped by source page so single pages can be replaced"""
+
+    def __init__(self, dim, model_name, compression="none", pca_dim=0, rescore_factor=4):
+        self.dim = dim
+        self.model_name = model_name
+        self.compression = compression
+        self.pca_dim = pca_dim
+        self.rescore_factor = rescore_factor
+        # Compressed indexes stage vectors in an exact index until the whole document is in
+        self.index = build_vector_index(dim)
+        self.trained = is_exact(compression, pca_dim)
+        self.page_hashes = []
+        self.page_chunk_ids = []
+        self.chunk_store = ChunkStore()
+        # Original float32 vectors by chunk id, kept only for re-scoring a compressed index
+        self.vectors = None
+        # Header/footer line keys learned from the first pages, reused for later pages and updates
+        self.boilerplate = None
+        # Large-font heading lines per page, and the section structure derived from them on demand
+        self.page_headings = []
+        self.section_index = None
+
+    @property
+    def next_id(self):
+        return self.chunk_store.next_id
+
+    @classmethod
+    def build(cls, page_texts, page_hashes, dim, model_name, chunk_fn, encode_fn,
+              compression="none", pca_dim=0, rescore_factor=4):
+        """Chunk and embed every page of a new document"""
+        page_index = cls(dim, model_name, compression, pca_dim, rescore_factor)
+        page_index.add_pages(page_texts, page_hashes, chunk_fn, encode_fn)
+        page_index.train_compression()
+        return page_index
+
+    def add_pages(self, page_texts, page_hashes, chunk_fn, encode_fn, page_headings=None):
+        """Append pages to the end of the document, e.g. as they stream out of extraction"""
+        first_page = len(self.page_hashes)
+        ids_per_page = self._add_pages(
+            page_texts, range(first_page, first_page + len(page_texts)), chunk_fn, encode_fn
+        )
+        self.page_hashes.extend(page_hashes)
+        self.page_chunk_ids.extend(ids_per_page)
+        self.page_headings.extend(page_headings or [[] for _ in page_texts])
+        self.section_index = None
+
+    def _add_pages(self, page_texts, page_numbers, chunk_fn, encode_fn):
+        """Embed the chunks of all given pages in one encoder call, return chunk ids per page"""
+        page_chunks = [chunk_fn(text) for text in page_texts]
+        flat_chunks = [chunk for chunks in page_chunks for chunk in chunks]
+        flat_pages = [page for page, chunks in zip(page_numbers, page_chunks) for _ in chunks]
+        flat_spans = [span for text, chunks in zip(page_texts, page_chunks) for span in locate_chunks(text, chunks)]
+
+        ids = self.chunk_store.append(flat_chunks, flat_pages, flat_spans)
+        if ids:
+            embeddings = np.asarray(encode_fn(flat_chunks), dtype="float32")
+            self.index.add_with_ids(embeddings, np.array(ids, dtype="int64"))
+            if not is_exact(self.compression, self.pca_dim):
+                # Chunk ids are dense, so row i of vectors belongs to chunk i
+                previous = self.vectors if self.vectors is not None else np.zeros((0, self.dim), dtype="float32")
+                self.vectors = np.concatenate((np.asarray(previous), embeddings))
+
+        ids_per_page = []
+        cursor = 0
+        for chunks in page_chunks:
+            ids_per_page.append(ids[cursor:cursor + len(chunks)])
+            cursor += len(chunks)
+        return ids_per_page
+
+    def train_compression(self):
+        """Replace the exact staging index with the compressed one, trained on every vector of the document.
+
+        Pages stream in a few at a time; training on the first batch would fit
+        int8 ranges to a few pages and rarely have enough vectors for PCA.
+        """
+        if self.trained:
+            return
+        self.trained = True
+        ids = np.flatnonzero(self.chunk_store.lengths >= 0).astype("int64")
+        self.pca_dim = usable_pca_dim(self.pca_dim, len(ids), self.dim)
+        if is_exact(self.compression, self.pca_dim):
+            # Too few vectors for PCA and no quantizer: the staging index is the final one
+            self.vectors = None
+            return
+        if not len(ids):
+            return
+        vectors = np.asarray(self.vectors[ids], dtype="float32")
+        index = build_vector_index(self.dim, self.compression, self.pca_dim)
+        index.train(vectors)
+        index.add_with_ids(vectors, ids)
+        self.index = index
+
+    def search(self, query_embeddings, top_k, section_probe=0):
+        """Nearest chunks per query; compressed indexes re-rank a larger candidate set with exact vectors.
+
+        With section_probe, search is coarse-to-fine: queries are matched to
+        section centroids first and only chunks of the closest sections are scored.
+        """
+        query_embeddings = np.asarray(query_embeddings, dtype="float32")
+        if section_probe and len(self.sections().paths) > section_probe:
+            return self._search_sections(query_embeddings, top_k, section_probe)
+        if self.vectors is None:
+            return self.index.search(query_embeddings, top_k)
+        return rescore(self.index, self.vectors, query_embeddings, top_k, self.rescore_factor)
+
+    def chunk_vectors(self, ids):
+        """Exact float32 embeddings of chunk ids (from the re-scoring vectors or the flat index)"""
+        if self.vectors is not None:
+            return np.asarray(self.vectors[np.asarray(ids, dtype="int64")], dtype="float32")
+        return np.stack([self.index.reconstruct(int(chunk_id)) for chunk_id in ids])
+
+    def ordered_chunks(self):
+        for page, ids in enumerate(self.page_chunk_ids):
+            for chunk_id in ids:
+                yield chunk_id, page, self.chunk_store[chunk_id]
+
+    def sections(self):
+        """Section structure of the document, derived on first use after a change"""
+        if self.section_index is None:
+            headings = self.page_headings
+            self.section_index = SectionIndex.build(
+                self.ordered_chunks(), lambda page: headings[page] if page < len(headings) else []
+            )
+        return self.section_index
+
+    def section_path(self, chunk_id):
+        return self.sections().path(chunk_id)
+
+    def _search_sections(self, query_embeddings, top_k, section_probe):
+        sections = self.sections()
+        if sections.centroids is None:
+            sections.compute_centroids(self.chunk_vectors)
+
+        all_distances = np.full((len(query_embeddings), top_k), np.inf, dtype="float32")
+        all_indices = np.full((len(query_embeddings), top_k), -1, dtype="int64")
+        for row, query in enumerate(query_embeddings):
+            ids = sections.candidates(query, section_probe, top_k)
+            exact = ((self.chunk_vectors(ids) - query) ** 2).sum(axis=1)
+            order = np.argsort(exact)[:top_k]
+            all_distances[row, :len(order)] = exact[order]
+            all_indices[row, :len(order)] = ids[order]
+        return all_distances, all_indices
+
+    def memory_footprint(self):
+        """Resident bytes of the vector index and chunk store (re-scoring vectors stay on disk once saved)"""
+        return {
+            "index_bytes": index_memory_bytes(self.index),
+            "chunk_store_bytes": self.chunk_store.nbytes(),
+            "rescore_vectors_bytes": 0 if self.vectors is None else int(self.vectors.nbytes),
+        }
+
+    def plan_update(self, new_hashes):
+        """Match new page hashes against indexed pages by content, not position.
+
+        Returns (reused, changed): reused maps new page number -> old page number,
+        changed lists the new page numbers that must be extracted and embedded.
+        """
+        old_pages_by_hash = {}
+        for old_page, page_hash in enumerate(self.page_hashes):
+            old_pages_by_hash.setdefault(page_hash, []).append(old_page)
+
+        reused = {}
+        changed = []
+        for new_page, page_hash in enumerate(new_hashes):
+            candidates = old_pages_by_hash.get(page_hash)
+            if candidates:
+                reused[new_page] = candidates.pop(0)
+            else:
+                changed.append(new_page)
+        return reused, changed
+
+    def copy(self):
+        """Deep copy so an update never mutates the index readers are using"""
+        clone = PageIndex.__new__(PageIndex)
+        clone.dim = self.dim
+        clone.model_name = self.model_name
+        clone.compression = self.compression
+        clone.pca_dim = self.pca_dim
+        clone.rescore_factor = self.rescore_factor
+        clone.trained = self.trained
+        clone.vectors = None if self.vectors is None else np.array(self.vectors)
+        clone.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+        clone.page_hashes = list(self.page_hashes)
+        clone.page_chunk_ids = [list(ids) for ids in self.page_chunk_ids]
+        clone.chunk_store = self.chunk_store.copy()
+        clone.boilerplate = None if self.boilerplate is None else set(self.boilerplate)
+        clone.page_headings = [list(headings) for headings in self.page_headings]
+        clone.section_index = None
+        return clone
+
+    def updated(self, new_hashes, changed_texts, chunk_fn, encode_fn, changed_headings=None):
+        """Return a new PageIndex for the new document version.
+
+        changed_texts maps each changed page number to its text (and
+        changed_headings, optionally, to its large-font headings). Chunks of
+        unchanged pages keep their ids and vectors; chunks of pages that no
+        longer exist are removed by id. The current index is left untouched.
+        """
+        reused, changed = self.plan_update(new_hashes)
+        new_index = self.copy()
+
+        kept_old_pages = set(reused.values())
+        stale_ids = [
+            chunk_id
+            for old_page, ids in enumerate(self.page_chunk_ids)
+            if old_page not in kept_old_pages
+            for chunk_id in ids
+        ]
+        if stale_ids:
+            new_index.index.remove_ids(np.array(stale_ids, dtype="int64"))
+            new_index.chunk_store.remove(stale_ids)
+
+        added_ids = new_index._add_pages(
+            [changed_texts[page] for page in changed], changed, chunk_fn, encode_fn
+        )
+        added_by_page = dict(zip(changed, added_ids))
+
+        new_index.page_hashes = list(new_hashes)
+        new_index.page_chunk_ids = [
+            self.page_chunk_ids[reused[page]] if page in reused else added_by_page[page]
+            for page in range(len(new_hashes))
+        ]
+        changed_headings = changed_headings or {}
+        new_index.page_headings = [
+            self.page_headings[reused[page]] if page in reused and reused[page] < len(self.page_headings)
+            else changed_headings.get(page, [])
+            for page in range(len(new_hashes))
+        ]
+        # Reused pages may have moved (e.g. a page was inserted before them)
+        for new_page, old_page in reused.items():
+            if new_page != old_page:
+                new_index.chunk_store.set_pages(self.page_chunk_ids[old_page], new_page)
+        return new_index
+
+    def save(self, root):
+        """Write a new version directory and atomically point CURRENT at it.
+
+        The previous version is kept so readers that resolved CURRENT before the
+        swap can still finish loading; anything older is pruned.
+        """
+        self.train_compression()
+        os.makedirs(root, exist_ok=True)
+        version = f"v{time.time_ns()}"
+        tmp_dir = os.path.join(root, f".tmp-{version}-{os.getpid()}")
+        os.makedirs(tmp_dir)
+
+        faiss.write_index(self.index, os.path.join(tmp_dir, "index.faiss"))
+        meta = {
+            "dim": self.dim,
+            "model_name": self.model_name,
+            "compression": self.compression,
+            "pca_dim": self.pca_dim,
+            "rescore_factor": self.rescore_factor,
+            "page_hashes": self.page_hashes,
+            "page_chunk_ids": self.page_chunk_ids,
+            "boilerplate": None if self.boilerplate is None else sorted(self.boilerplate),
+            "page_headings": self.page_headings,
+        }
+        self.chunk_store.save(tmp_dir)
+        if self.vectors is not None:
+            np.save(os.path.join(tmp_dir, "vectors.npy"), self.vectors)
+        with open(os.path.join(tmp_dir, "pages.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+        os.rename(tmp_dir, os.path.join(root, version))
+
+        pointer_tmp = os.path.join(root, f"CURRENT.tmp-{os.getpid()}")
+        with open(pointer_tmp, "w") as f:
+            f.write(version)
+        os.replace(pointer_tmp, os.path.join(root, "CURRENT"))
+
+        versions = sorted(name for name in os.listdir(root) if name.startswith("v"))
+        for old_version in versions[:-2]:
+            shutil.rmtree(os.path.join(root, old_version), ignore_errors=True)
+        return version
+
+    @classmethod
+    def load(cls, root, model_name=None):
+        """Load the CURRENT version from root, or None if there is no usable index"""
+        pointer = os.path.join(root, "CURRENT")
+        if not os.path.exists(pointer):
+            return None
+        with open(pointer) as f:
+            version_dir = os.path.join(root, f.read().strip())
+
+        with open(os.path.join(version_dir, "pages.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if model_name and meta["model_name"] != model_name:
+            # Vectors from another embedding model are not comparable
+            return None
+
+        page_index = cls.__new__(cls)
+        page_index.dim = meta["dim"]
+        page_index.model_name = meta["model_name"]
+        page_index.compression = meta.get("compression", "none")
+        page_index.pca_dim = meta.get("pca_dim", 0)
+        page_index.rescore_factor = meta.get("rescore_factor", 4)
+        page_index.trained = True
+        vectors_file = os.path.join(version_dir, "vectors.npy")
+        page_index.vectors = np.load(vectors_file, mmap_mode="r") if os.path.exists(vectors_file) else None
+        page_index.index = faiss.read_index(os.path.join(version_dir, "index.faiss"))
+        page_index.page_hashes = meta["page_hashes"]
+        page_index.page_chunk_ids = meta["page_chunk_ids"]
+        boilerplate = meta.get("boilerplate")
+        page_index.boilerplate = None if boilerplate is None else set(boilerplate)
+        page_index.page_headings = meta.get("page_headings", [])
+        page_index.section_index = None
+        if "chunk_map" in meta:
+            # Written before chunks were kept in a ChunkStore
+            page_index.chunk_store = ChunkStore.from_mapping({int(k): v for k, v in meta["chunk_map"].items()})
+        else:
+            page_index.chunk_store = ChunkStore.load(version_dir)
+        return page_index
@@ -0,0 +1,160 @@
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+COMPRESSION_MODES = ("none", "fp16", "int8")
+
+# PCA is only trained when there are at least this many vectors per output dimension
+PCA_MIN_VECTORS_PER_DIM = 2
+
+
+def build_vector_index(dim, compression="none", pca_dim=0):
+    """IndexIDMap2 over a flat, fp16 or int8 scalar-quantized index, optionally behind a PCA projection"""
+    if compression not in COMPRESSION_MODES:
+        raise ValueError(f"Unknown vector compression: {compression}")
+
+    inner_dim = pca_dim or dim
+    if compression == "fp16":
+        inner = faiss.IndexScalarQuantizer(inner_dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    elif compression == "int8":
+        inner = faiss.IndexScalarQuantizer(inner_dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+    else:
+        inner = faiss.IndexFlatL2(inner_dim)
+
+    if pca_dim:
+        inner = faiss.IndexPreTransform(faiss.PCAMatrix(dim, pca_dim), inner)
+    return faiss.IndexIDMap2(inner)
+
+
+def usable_pca_dim(pca_dim, vector_count, dim):
+    """PCA dimension that can be trained from vector_count vectors (0 disables PCA)"""
+    if not pca_dim or pca_dim >= dim or vector_count < pca_dim * PCA_MIN_VECTORS_PER_DIM:
+        return 0
+    return pca_dim
+
+
+def is_exact(compression, pca_dim):
+    return compression == "none" and not pca_dim
+
+
+def rescore(index, vectors, query_embeddings, top_k, rescore_factor):
+    """Search the compressed index for top_k * rescore_factor candidates and re-rank them with exact float L2.
+
+    vectors holds the original float32 embedding of every chunk id (memory-mapped
+    from disk once saved), so only the small candidate set is ever read.
+    """
+    query_embeddings = np.asarray(query_embeddings, dtype="float32")
+    _, candidates = index.search(query_embeddings, top_k * rescore_factor)
+
+    all_distances = np.full((len(query_embeddings), top_k), np.inf, dtype="float32")
+    all_indices = np.full((len(query_embeddings), top_k), -1, dtype="int64")
+    for row, query in enumerate(query_embeddings):
+        ids = candidates[row][candidates[row] >= 0]
+        if len(ids) == 0:
+            continue
+        exact = ((np.asarray(vectors[ids], dtype="float32") - query) ** 2).sum(axis=1)
+        order = np.argsort(exact)[:top_k]
+        all_distances[row, :len(order)] = exact[order]
+        all_indices[row, :len(order)] = ids[order]
+    return all_distances, all_indices
+
+
+def index_nbytes(index):
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def index_memory_bytes(index):
+    """Estimated resident bytes of a build_vector_index index, from ntotal and code size (no copy)"""
+    ntotal = index.ntotal
+    # IndexIDMap2 keeps an id array and a reverse id -> row map
+    nbytes = ntotal * 16
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(inner, faiss.IndexPreTransform):
+        for position in range(inner.chain.size()):
+            transform = faiss.downcast_VectorTransform(inner.chain.at(position))
+            nbytes += transform.d_in * transform.d_out * 4
+        inner = faiss.downcast_index(inner.index)
+    return int(nbytes + ntotal * getattr(inner, "code_size", inner.d * 4))
+
+
+def evaluate_compression(embeddings, query_embeddings, top_k=5, rescore_factor=4, configs=None):
+    """Memory footprint and recall@k of each compression config against the float32 flat baseline"""
+    embeddings = np.asarray(embeddings, dtype="float32")
+    query_embeddings = np.asarray(query_embeddings, dtype="float32")
+    dim = embeddings.shape[1]
+    ids = np.arange(len(embeddings), dtype="int64")
+
+    baseline = build_vector_index(dim)
+    baseline.add_with_ids(embeddings, ids)
+    _, truth = baseline.search(query_embeddings, top_k)
+    baseline_bytes = index_nbytes(baseline)
+
+    configs = configs or [
+        ("none", 0), ("fp16", 0), ("int8", 0),
+        ("none", dim // 2), ("fp16", dim // 2), ("int8", dim // 2), ("int8", dim // 4),
+    ]
+    report = []
+    for compression, pca_dim in configs:
+        pca_dim = usable_pca_dim(pca_dim, len(embeddings), dim)
+        index = build_vector_index(dim, compression, pca_dim)
+        index.train(embeddings)
+        index.add_with_ids(embeddings, ids)
+
+        for rescored in ((False, True) if not is_exact(compression, pca_dim) else (False,)):
+            started = time.perf_counter()
+            if rescored:
+                _, found = rescore(index, embeddings, query_embeddings, top_k, rescore_factor)
+            else:
+                _, found = index.search(query_embeddings, top_k)
+            elapsed = time.perf_counter() - started
+
+            hits = sum(len(set(found[row]) & set(truth[row])) for row in range(len(query_embeddings)))
+            nbytes = index_nbytes(index)
+            report.append({
+                "compression": compression,
+                "pca_dim": pca_dim,
+                "rescored": rescored,
+                "index_bytes": nbytes,
+                "bytes_per_vector": nbytes / max(len(embeddings), 1),
+                "memory_vs_float32": nbytes / baseline_bytes,
+                f"recall@{top_k}": hits / (len(query_embeddings) * top_k),
+                "search_ms_per_query": elapsed * 1000 / max(len(query_embeddings), 1),
+            })
+    return report
+
+
+def print_report(report):
+    recall_key = next(key for key in report[0] if key.startswith("recall@"))
+    print(f"{'compression':<12}{'pca':>6}{'rescore':>9}{'bytes/vec':>11}{'memory':>9}{recall_key:>11}{'ms/query':>10}")
+    for row in report:
+        print(
+            f"{row['compression']:<12}{row['pca_dim'] or '-':>6}{'yes' if row['rescored'] else 'no':>9}"
+            f"{row['bytes_per_vector']:>11.1f}{row['memory_vs_float32']:>8.0%} {row[recall_key]:>10.3f}"
+            f"{row['search_ms_per_query']:>10.3f}"
+        )
+
+
+# Usage: python clause-matcher/quantization.py <extracted text file> [top_k]
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from main import get_embedding_model, split_into_chunks
+
+    if len(sys.argv) < 2:
+        print("Usage: python clause-matcher/quantization.py <extracted text file> [top_k]")
+        sys.exit(1)
+
+    with open(sys.argv[1], "r", encoding="utf-8") as f:
+        chunks = split_into_chunks(f.read())
+    top_k = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    model = get_embedding_model()
+    chunk_embeddings = model.encode(chunks)
+    # Use a sample of the chunks themselves, lightly truncated, as queries
+    sample = chunks[::max(len(chunks) // 200, 1)]
+    query_embeddings = model.encode([chunk[: len(chunk) // 2] for chunk in sample])
+
+    print(f"{len(chunks)} chunks, {len(sample)} queries, dim {chunk_embeddings.shape[1]}")
+    print_report(evaluate_compression(chunk_embeddings, query_embeddings, top_k=top_k))
@@ -0,0 +1,89 @@
+import re
+
+import numpy as np
+
+# Numbered clause headings such as "4.2 Waiting Period", "4. Exclusions" or "Section 3 - Exclusions": the
+# number is dotted or follows "Section", then comes a capitalised word that is not a unit, and the line does
+# not end in a period. A bare number ("24 Months", "5 Cataract") is too often a wrapped sentence or a table
+# value; such headings are only taken from font_headings
+HEADING_UNITS = r"(?i:months?|days?|years?|weeks?|hours?|lakhs?|lacs?|crores?|thousand|hundred|rs|inr|rupees|percent|times)"
+SECTION_HEADING = re.compile(
+    r"^\s*((?:(?:[Ss]ection|SECTION)\s+\d+(?:\.\d+)*\.?|\d+(?:\.\d+)+\.?|\d+\.)\s+(?:-\s+)?"
+    r"(?!" + HEADING_UNITS + r"\b)[A-Z][A-Za-z'’]+\b[^\n]{0,78}(?<![.\s]))\s*$",
+    re.MULTILINE,
+)
+SECTION_NUMBER = re.compile(r"^\s*(?:section\s+)?(\d+(?:\.\d+)*)", re.IGNORECASE)
+
+
+def heading_level(heading):
+    """Nesting depth from the clause number ("4" -> 1, "4.2" -> 2); unnumbered headings are top level"""
+    match = SECTION_NUMBER.match(heading)
+    return match.group(1).count(".") + 1 if match else 1
+
+
+def chunk_headings(chunk, font_headings=()):
+    """Headings that start inside a chunk, in reading order.
+
+    Numbered headings are found by pattern; font_headings are lines the PDF
+    sets in a larger font (from pdf-extract's extract_page_headings).
+    """
+    flat = " ".join(chunk.split())
+    found = {match.group(1).strip(): flat.find(" ".join(match.group(1).split())) for match in SECTION_HEADING.finditer(chunk)}
+    for heading in font_headings:
+        position = flat.find(" ".join(heading.split()))
+        if position >= 0:
+            found.setdefault(heading.strip(), position)
+    return [heading for heading, _ in sorted(found.items(), key=lambda item: item[1])]
+
+
+class SectionIndex:
+    """Sections of one document and a centroid per section for coarse-to-fine search.
+
+    A chunk belongs to the last heading seen at or before it in reading order;
+    the section path is the chain of enclosing headings. A section's summary
+    vector is the mean of its chunk embeddings.
+    """
+
+    def __init__(self, paths, members):
+        self.paths = paths
+        self.members = [np.asarray(ids, dtype="int64") for ids in members]
+        self.section_of = {int(chunk_id): section for section, ids in enumerate(members) for chunk_id in ids}
+        self.centroids = None
+
+    @classmethod
+    def build(cls, ordered_chunks, page_headings):
+        """ordered_chunks: (chunk_id, page, text) in reading order; page_headings: page -> font headings"""
+        stack = []
+        paths = [()]
+        members = [[]]
+        for chunk_id, page, text in ordered_chunks:
+            for heading in chunk_headings(text, page_headings(page)):
+                level = heading_level(heading)
+                while stack and stack[-1][0] >= level:
+                    stack.pop()
+                stack.append((level, heading))
+                paths.append(tuple(title for _, title in stack))
+                members.append([])
+            members[-1].append(chunk_id)
+        kept = [section for section, ids in enumerate(members) if ids]
+        return cls([paths[section] for section in kept], [members[section] for section in kept])
+
+    def path(self, chunk_id):
+        section = self.section_of.get(int(chunk_id))
+        return " > ".join(self.paths[section]) if section is not None else ""
+
+    def compute_centroids(self, vectors_fn):
+        """vectors_fn(ids) -> float32 embeddings of those chunk ids"""
+        self.centroids = np.stack([vectors_fn(ids).mean(axis=0) for ids in self.members]).astype("float32")
+
+    def candidates(self, query_embedding, section_probe, min_candidates):
+        """Chunk ids of the closest sections: at least section_probe of them and min_candidates chunks"""
+        distances = ((self.centroids - query_embedding) ** 2).sum(axis=1)
+        chosen = []
+        count = 0
+        for section in np.argsort(distances):
+            chosen.append(self.members[section])
+            count += len(self.members[section])
+            if len(chosen) >= section_probe and count >= min_candidates:
+                break
+        return np.concatenate(chosen)
@@ -0,0 +1,123 @@
+import re
+from collections import Counter
+
+# Running headers and footers live in the first and last few lines of a page
+EDGE_LINES = 4
+# A line is boilerplate when it recurs at a page edge on at least this share of pages...
+BOILERPLATE_MIN_SHARE = 0.5
+# ...and on at least this many pages, so short documents are never over-stripped
+BOILERPLATE_MIN_PAGES = 3
+
+NUMBER = re.compile(r"\d+")
+HYPHENATED_BREAK = re.compile(r"([a-z])-\n\s*([a-z])")
+SPACE_RUNS = re.compile(r"[ \t ]+")
+BLANK_RUNS = re.compile(r"\n{3,}")
+
+
+def line_key(line):
+    """Comparable form of a line (whitespace and case normalised)"""
+    return SPACE_RUNS.sub(" ", line).strip().lower()
+
+
+def page_number_key(key, page_number):
+    """Key of a line whose first number counts pages: "page 3 of 40" on page 2 -> "page # of #@1".
+
+    Lines like "Page 3 of 40" or a bare "3" only match across pages when their
+    number moves with the page, so amounts or table values at a page edge that
+    merely share a shape are never taken for page numbers. None without digits.
+    """
+    match = NUMBER.search(key)
+    if match is None:
+        return None
+    return f"{NUMBER.sub('#', key)}@{int(match.group()) - page_number}"
+
+
+def edge_positions(lines):
+    """Positions of the non-empty lines at the top and bottom of a page"""
+    positions = [i for i, line in enumerate(lines) if line.strip()]
+    # Short pages get a narrower edge so their body text is never treated as a header
+    edge = max(1, min(EDGE_LINES, len(positions) // 3))
+    return positions[:edge] + positions[edge:][-edge:]
+
+
+def find_boilerplate(pages, page_numbers=None):
+    """Line keys that recur at the edges of enough pages to be headers, footers, stamps or page numbers"""
+    if len(pages) < BOILERPLATE_MIN_PAGES:
+        return set()
+    counts = Counter()
+    for page_number, page_text in zip(page_numbers or range(len(pages)), pages):
+        lines = page_text.splitlines()
+        keys = set()
+        for i in edge_positions(lines):
+            key = line_key(lines[i])
+            keys.add(key)
+            keys.add(page_number_key(key, page_number))
+        keys.discard(None)
+        counts.update(keys)
+    threshold = max(BOILERPLATE_MIN_PAGES, len(pages) * BOILERPLATE_MIN_SHARE)
+    return {key for key, count in counts.items() if key and count >= threshold}
+
+
+def clean_page(page_text, boilerplate=(), page_number=0):
+    """Drop boilerplate and page-number lines, re-join words broken across lines and collapse whitespace"""
+    lines = page_text.splitlines()
+    edges = set(edge_positions(lines))
+    kept = []
+    for i, line in enumerate(lines):
+        if i in edges:
+            key = line_key(line)
+            if key in boilerplate or page_number_key(key, page_number) in boilerplate:
+                continue
+        kept.append(SPACE_RUNS.sub(" ", line).strip())
+    text = "\n".join(kept)
+    # The hyphen stays: "pre-existing" and "co-payment" are defined policy terms
+    text = HYPHENATED_BREAK.sub(r"\1-\2", text)
+    return BLANK_RUNS.sub("\n\n", text).strip()
+
+
+def clean_pages(pages, boilerplate=None, chunk_fn=None, page_numbers=None):
+    """Clean a batch of pages; returns (cleaned pages, boilerplate used, report).
+
+    page_numbers are the 0-based positions of the pages in their document
+    (default: the batch starts the document). boilerplate is learned from the
+    pages themselves unless given. With chunk_fn
+    the report also counts chunks before cleaning; that tokenizes every raw page
+    once more, so it is meant for offline reports. Chunks after cleaning are
+    counted by whoever chunks the cleaned pages (chunks_after).
+    """
+    page_numbers = list(page_numbers) if page_numbers is not None else list(range(len(pages)))
+    if boilerplate is None:
+        boilerplate = find_boilerplate(pages, page_numbers)
+    cleaned = [clean_page(page_text, boilerplate, page_number) for page_number, page_text in zip(page_numbers, pages)]
+    report = {
+        "pages": len(pages),
+        "boilerplate_lines": len(boilerplate),
+        "chars_before": sum(len(page_text) for page_text in pages),
+        "chars_after": sum(len(page_text) for page_text in cleaned),
+    }
+    if chunk_fn is not None:
+        report["chunks_before"] = sum(len(chunk_fn(page_text)) for page_text in pages)
+    return cleaned, boilerplate, report
+
+
+def merge_reports(total, report):
+    """Add one batch report into a running total"""
+    for key, value in report.items():
+        if key == "boilerplate_lines":
+            total[key] = max(total.get(key, 0), value)
+        else:
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def describe_report(report):
+    removed_chars = report.get("chars_before", 0) - report.get("chars_after", 0)
+    summary = (
+        f"Cleaning removed {removed_chars} of {report.get('chars_before', 0)} characters"
+        f" ({report.get('boilerplate_lines', 0)} boilerplate lines) across {report.get('pages', 0)} pages"
+    )
+    if "chunks_before" in report:
+        summary += f", chunks {report['chunks_before']} -> {report.get('chunks_after', 0)}"
+    elif "chunks_after" in report:
+        summary += f", {report['chunks_after']} chunks"
+    return summary
@@ -0,0 +1,93 @@
+import math
+import threading
+
+# Rough characters per token for English policy text, used when the API reports no usage
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def response_usage(response, prompt, completion=None):
+    """Prompt/completion token counts of a Gemini response, estimated from the text if not reported"""
+    metadata = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(metadata, "prompt_token_count", None)
+    completion_tokens = getattr(metadata, "candidates_token_count", None)
+    if prompt_tokens is None:
+        prompt_tokens = estimate_tokens(prompt)
+    if completion_tokens is None:
+        completion_tokens = estimate_tokens(completion)
+    return {"prompt_tokens": int(prompt_tokens), "completion_tokens": int(completion_tokens)}
+
+
+class TokenUsage:
+    """Process-wide token totals and call time per kind of LLM call ("parse", "answer")"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {}
+
+    def record(self, kind, usage, seconds=None):
+        """Add one call; seconds is the time spent in generate_content alone, when it was measured"""
+        with self._lock:
+            total = self.totals.setdefault(
+                kind, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "timed_calls": 0, "seconds": 0.0}
+            )
+            total["calls"] += 1
+            total["prompt_tokens"] += usage["prompt_tokens"]
+            total["completion_tokens"] += usage["completion_tokens"]
+            if seconds is not None:
+                total["timed_calls"] += 1
+                total["seconds"] += seconds
+
+    def average_seconds(self, kind, default):
+        """Mean generate_content time of the timed calls of a kind (no queueing), or default before any"""
+        with self._lock:
+            total = self.totals.get(kind)
+            if not total or not total["timed_calls"]:
+                return default
+            return total["seconds"] / total["timed_calls"]
+
+    def metrics(self):
+        with self._lock:
+            return {
+                kind: {
+                    "calls_total": total["calls"],
+                    "prompt_tokens_total": total["prompt_tokens"],
+                    "completion_tokens_total": total["completion_tokens"],
+                    "avg_prompt_tokens": total["prompt_tokens"] / total["calls"],
+                    "avg_seconds": round(total["seconds"] / total["timed_calls"], 3) if total["timed_calls"] else None,
+                }
+                for kind, total in self.totals.items()
+            }
+
+
+def adaptive_k(results, min_k, max_k, gap_share=0.5):
+    """Number of results to keep from the L2 distance gap.
+
+    When one gap between consecutive distances (sorted, within the first
+    max_k) holds at least gap_share of the total spread, the results before
+    it clearly dominate and only those are kept; flat scores keep max_k.
+    """
+    distances = sorted(result["score"] for result in results)[:max_k]
+    if len(distances) <= min_k:
+        return len(distances)
+    spread = distances[-1] - distances[0]
+    if spread <= 0:
+        return len(distances)
+    gaps = [distances[i] - distances[i - 1] for i in range(1, len(distances))]
+    widest = max(range(len(gaps)), key=lambda i: gaps[i])
+    if gaps[widest] < spread * gap_share:
+        return len(distances)
+    return max(min_k, widest + 1)
+
+
+def within_token_budget(results, token_budget):
+    """Longest prefix of results whose chunks fit in token_budget (always at least one)"""
+    used = 0
+    for count, result in enumerate(results):
+        used += estimate_tokens(result["chunk"])
+        if count and used > token_budget:
+            return results[:count]
+    return results
@@ -0,0 +1,43 @@
+import time
+
+
+class Deadline:
+    """Latency budget of one submission and the degradation steps taken to stay within it.
+
+    A deadline of None means no budget: every check allows everything and
+    nothing is degraded. Steps, cheapest to give up first:
+      skip_artifacts - no table/image extraction for a newly ingested PDF
+      skip_llm_parse - keep local parses instead of refining them with Gemini
+      reduce_top_k   - fewer chunks per question
+      skip_rerank    - no over-fetch and section preference
+      fast_model     - answer with the faster LLM
+      partial        - return whatever answers are ready, flagged as partial
+    """
+
+    def __init__(self, budget_seconds=None):
+        self.budget_seconds = budget_seconds
+        self.expires_at = None if budget_seconds is None else time.monotonic() + budget_seconds
+        self.steps = []
+
+    def remaining(self):
+        if self.expires_at is None:
+            return float("inf")
+        return self.expires_at - time.monotonic()
+
+    def allows(self, seconds):
+        """Whether work expected to take seconds still fits in the budget"""
+        return self.remaining() > seconds
+
+    def degrade(self, step, needed_seconds):
+        """Record and return True if step must be taken because needed_seconds no longer fit"""
+        if self.allows(needed_seconds):
+            return False
+        if step not in self.steps:
+            self.steps.append(step)
+        return True
+
+    def timeout(self, margin=0.0):
+        """Seconds left for an await, keeping margin to build the response (None without a deadline)"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.remaining() - margin)
@@ -0,0 +1,332 @@
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+import requests
+
+from artifacts import INDEX_ROOT, document_id, index_dir
+
+# Bulk offline ingestion: pre-builds the per-document indexes the API loads (INDEX_ROOT/<doc id>)
+# and, optionally, adds every document to the policy library. The API indexes PDFs only, so
+# DOCX/EML/text documents are useful with --library.
+#
+#   python ingest.py ./policies --workers 8
+#   python ingest.py manifest.jsonl --library
+#
+# A manifest is JSONL ({"document": path or URL, "insurer": ..., "policy_name": ..., "version": ...})
+# or plain text with one path or URL per line. Completed documents are appended to
+# INDEX_ROOT/ingest_state.jsonl with the outputs written for them ("index", "library"), so an
+# interrupted run picks up where it stopped and a later run with --library still fills the library.
+# Non-PDF documents ingested without --library produce nothing and are recorded as "skipped".
+
+DOCUMENT_EXTENSIONS = (".pdf", ".docx", ".eml", ".txt")
+
+# Extraction runs in worker processes, which only need the extractor module
+pdf_spec = importlib.util.spec_from_file_location("pdf_main", str(Path(__file__).parent / "pdf-extract" / "main.py"))
+pdf_main = importlib.util.module_from_spec(pdf_spec)
+pdf_spec.loader.exec_module(pdf_main)
+
+
+def read_documents(source):
+    """Documents to ingest from a directory (recursively) or a manifest file"""
+    if os.path.isdir(source):
+        return [
+            {"document": str(path)}
+            for path in sorted(Path(source).rglob("*"))
+            if path.suffix.lower() in DOCUMENT_EXTENSIONS
+        ]
+    documents = []
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            documents.append(json.loads(line) if line.startswith("{") else {"document": line})
+    return documents
+
+
+def fingerprint(document):
+    """Changes when a local file changes; URLs are identified by the URL alone"""
+    if document.startswith(("http://", "https://")):
+        return ""
+    stat = os.stat(document)
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def wanted_outputs(document_format, library):
+    """What ingesting a document writes: its API index (PDFs only) and, with --library, its library entry"""
+    outputs = set()
+    if document_format == "pdf":
+        outputs.add("index")
+    if library:
+        outputs.add("library")
+    return outputs
+
+
+def missing_outputs(done, library):
+    """Outputs a run asks for that an earlier run did not write for the document"""
+    document_format = done.get("format")
+    # Entries written before outputs were recorded only ever wrote the index
+    produced = set(done.get("outputs", ["index"] if document_format == "pdf" else []))
+    return wanted_outputs(document_format, library) - produced
+
+
+def read_state(state_path):
+    """Completed (or skipped) documents by doc id, from earlier runs; the latest entry wins"""
+    completed = {}
+    if os.path.exists(state_path):
+        with open(state_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A run killed mid-write leaves a partial last line
+                    continue
+                if entry.get("status") in ("done", "skipped"):
+                    completed[entry["doc_id"]] = entry
+    return completed
+
+
+def extract_document(document):
+    """Worker process: page texts, page hashes and headings of one document"""
+    temp_path = None
+    try:
+        if document.startswith(("http://", "https://")):
+            response = requests.get(document, timeout=60)
+            response.raise_for_status()
+            data = response.content
+            content_type = response.headers.get("Content-Type")
+            filename = document.split("/")[-1].split("?")[0]
+        else:
+            with open(document, "rb") as f:
+                data = f.read()
+            content_type, filename = None, Path(document).name
+
+        document_format = pdf_main.detect_format(data, content_type, filename)
+        if document_format != "pdf":
+            return {"format": document_format, "text": pdf_main.extract_text_from_bytes(data, content_type, filename)}
+
+        path = document
+        if document.startswith(("http://", "https://")):
+            fd, temp_path = tempfile.mkstemp(suffix=".pdf")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            path = temp_path
+        page_hashes = pdf_main.compute_page_hashes(path)
+        pages = range(len(page_hashes))
+        texts = pdf_main.extract_page_texts(path, pages)
+        headings = pdf_main.extract_page_headings(path, pages)
+        return {
+            "format": "pdf",
+            "page_texts": [texts[page] for page in pages],
+            "page_hashes": page_hashes,
+            "page_headings": [headings[page] for page in pages],
+        }
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class EmbeddingBatcher:
+    """Embeds the chunks of several documents in shared, deduplicated encoder batches"""
+
+    def __init__(self, encode_fn, batch_size=512):
+        self.encode_fn = encode_fn
+        self.batch_size = batch_size
+        self.chunks_embedded = 0
+
+    def embed(self, texts):
+        """Vector for each distinct text"""
+        unique = list(dict.fromkeys(texts))
+        vectors = {}
+        for start in range(0, len(unique), self.batch_size):
+            batch = unique[start:start + self.batch_size]
+            for text, vector in zip(batch, self.encode_fn(batch)):
+                vectors[text] = vector
+        self.chunks_embedded += len(unique)
+        return vectors
+
+
+class Ingester:
+    """Main process: chunks, embeds and writes the indexes of extracted documents"""
+
+    def __init__(self, clause_main, batcher, library=None):
+        self.clause_main = clause_main
+        self.batcher = batcher
+        self.library = library
+
+    def build(self, items):
+        """items: (entry, extracted) pairs; returns chunk count per doc id"""
+        SemanticSearch = self.clause_main.SemanticSearch
+        split_into_chunks = self.clause_main.split_into_chunks
+
+        prepared = []
+        for entry, extracted in items:
+            if "page_texts" not in extracted:
+                extracted["page_texts"] = self.clause_main.split_pages(extracted.pop("text"))
+            search_engine = SemanticSearch(page_index=SemanticSearch.empty_page_index())
+            page_texts = search_engine.clean_pages(extracted["page_texts"])
+            page_chunks = {text: split_into_chunks(text) for text in page_texts}
+            prepared.append((entry, extracted, search_engine, page_texts, page_chunks))
+
+        # One encoder pass over the chunks of every document in the group
+        vectors = self.batcher.embed([
+            chunk for *_, page_chunks in prepared for chunks in page_chunks.values() for chunk in chunks
+        ])
+        encode = lambda chunks: [vectors[chunk] for chunk in chunks]
+
+        counts = {}
+        for entry, extracted, search_engine, page_texts, page_chunks in prepared:
+            chunk = page_chunks.__getitem__
+            if extracted["format"] == "pdf":
+                search_engine.page_index.add_pages(
+                    page_texts, extracted["page_hashes"], chunk, encode, extracted["page_headings"]
+                )
+                search_engine.page_index.save(index_dir(entry["doc_id"]))
+            if self.library is not None:
+                self.library.add_document(
+                    entry["doc_id"], page_texts, chunk, encode,
+                    insurer=entry.get("insurer", ""),
+                    policy_name=entry.get("policy_name", ""),
+                    version=entry.get("version", ""),
+                )
+            counts[entry["doc_id"]] = sum(len(page_chunks[text]) for text in page_texts)
+        return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-build document indexes for the API")
+    parser.add_argument("source", help="Directory of documents, or a manifest (JSONL or one path/URL per line)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Extraction processes")
+    parser.add_argument("--group", type=int, default=8, help="Documents embedded together in one batch")
+    parser.add_argument("--embed-batch", type=int, default=512, help="Chunks per encoder call")
+    parser.add_argument("--library", action="store_true", help="Also add documents to the policy library")
+    parser.add_argument("--state", default=os.path.join(INDEX_ROOT, "ingest_state.jsonl"), help="Resume state file")
+    parser.add_argument("--force", action="store_true", help="Re-ingest documents already completed")
+    args = parser.parse_args()
+
+    documents = read_documents(args.source)
+    os.makedirs(os.path.dirname(os.path.abspath(args.state)), exist_ok=True)
+    completed = {} if args.force else read_state(args.state)
+
+    pending = []
+    for entry in documents:
+        try:
+            entry["fingerprint"] = fingerprint(entry["document"])
+        except OSError as e:
+            print(f"Skipping {entry['document']}: {e}")
+            continue
+        entry["doc_id"] = document_id(entry["document"])
+        done = completed.get(entry["doc_id"])
+        if done is None or done.get("fingerprint") != entry["fingerprint"] or missing_outputs(done, args.library):
+            pending.append(entry)
+    print(f"{len(documents)} documents, {len(documents) - len(pending)} already ingested, {len(pending)} to go")
+    if not pending:
+        return
+
+    # The embedding model and cache live in this process only
+    sys.path.append(str(Path(__file__).parent / "clause-matcher"))
+    clause_spec = importlib.util.spec_from_file_location("clause_main", str(Path(__file__).parent / "clause-matcher" / "main.py"))
+    clause_main = importlib.util.module_from_spec(clause_spec)
+    clause_spec.loader.exec_module(clause_main)
+    library = None
+    if args.library:
+        from library import PolicyLibrary
+        library_root = os.getenv("LIBRARY_ROOT", str(Path(__file__).parent / "library"))
+        library = PolicyLibrary(library_root, clause_main.get_embedding_model().get_sentence_embedding_dimension())
+    batcher = EmbeddingBatcher(clause_main.encode_chunks, args.embed_batch)
+    ingester = Ingester(clause_main, batcher, library)
+
+    started = time.monotonic()
+    finished = failed = skipped = chunks_total = 0
+    ready = []
+
+    with open(args.state, "a", encoding="utf-8") as state, ProcessPoolExecutor(max_workers=args.workers) as pool:
+        def record(entry, **fields):
+            state.write(json.dumps({
+                "doc_id": entry["doc_id"], "document": entry["document"], "fingerprint": entry["fingerprint"],
+                "finished_at": time.time(), **fields,
+            }) + "\n")
+            state.flush()
+
+        def flush_ready():
+            nonlocal finished, failed, chunks_total
+            if not ready:
+                return
+            try:
+                counts = ingester.build(ready)
+            except Exception:
+                # Build the group one by one so a single bad document does not fail the rest
+                counts = {}
+                for item in ready:
+                    try:
+                        counts.update(ingester.build([item]))
+                    except Exception as item_error:
+                        failed += 1
+                        record(item[0], status="failed", error=str(item_error))
+                        print(f"Failed {item[0]['document']}: {item_error}")
+            for entry, extracted in ready:
+                if entry["doc_id"] in counts:
+                    finished += 1
+                    chunks_total += counts[entry["doc_id"]]
+                    record(entry, status="done", format=extracted["format"],
+                           outputs=sorted(wanted_outputs(extracted["format"], library is not None)),
+                           pages=len(extracted["page_texts"]), chunks=counts[entry["doc_id"]])
+            ready.clear()
+
+            elapsed = time.monotonic() - started
+            rate = (finished + failed + skipped) / elapsed if elapsed else 0.0
+            remaining = len(pending) - finished - failed - skipped
+            print(
+                f"[{finished + failed + skipped}/{len(pending)}] {finished} done, {skipped} skipped, {failed} failed - "
+                f"{rate * 60:.1f} docs/min, {chunks_total / elapsed:.0f} chunks/s, "
+                f"ETA {remaining / rate / 60 if rate else 0:.1f} min"
+            )
+
+        # Keep a bounded number of extractions in flight so memory stays flat on huge runs
+        queue = iter(pending)
+        in_flight = {}
+        for entry in queue:
+            in_flight[pool.submit(extract_document, entry["document"])] = entry
+            if len(in_flight) >= args.workers * 2:
+                break
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                entry = in_flight.pop(future)
+                try:
+                    extracted = future.result()
+                except Exception as e:
+                    failed += 1
+                    record(entry, status="failed", error=str(e))
+                    print(f"Failed {entry['document']}: {e}")
+                else:
+                    if wanted_outputs(extracted["format"], library is not None):
+                        ready.append((entry, extracted))
+                    else:
+                        # The API indexes PDFs only, so without a library there is nothing to write
+                        skipped += 1
+                        record(entry, status="skipped", format=extracted["format"], outputs=[])
+                        print(f"Skipped {entry['document']}: {extracted['format']} documents need --library")
+                next_entry = next(queue, None)
+                if next_entry is not None:
+                    in_flight[pool.submit(extract_document, next_entry["document"])] = next_entry
+            if len(ready) >= args.group or not in_flight:
+                flush_ready()
+
+    elapsed = time.monotonic() - started
+    print(
+        f"Ingested {finished} documents ({chunks_total} chunks) in {elapsed / 60:.1f} min, "
+        f"{skipped} skipped, {failed} failed"
+    )
+    print(f"Embedded {batcher.chunks_embedded} distinct chunks")
+
+
+if __name__ == "__main__":
+    main()
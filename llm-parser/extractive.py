@@ -0,0 +1,94 @@
+import re
+
+from local_parser import NUMERIC_INTENTS, SECTION_KEYWORDS
+
+# Intents whose answer is usually one clause of the policy, quoted as-is
+EXTRACTIVE_INTENTS = {"definition_request"} | NUMERIC_INTENTS
+
+SENTENCE_BREAK = re.compile(r"(?<=[.;])\s+(?=[A-Z(\"'‘“])")
+DEFINITION_VERBS = r"(?:means|shall mean|is defined as|are defined as|refers to|shall include)"
+
+NUMBER_WORD = r"(?:\d+|one|two|three|four|five|six|seven|eight|nine|ten|twelve|fifteen|twenty|thirty|forty|forty[- ]five|sixty|ninety)"
+DURATION = re.compile(rf"\b{NUMBER_WORD}(?:\s*\(\d+\))?\s*(?:consecutive\s+|continuous\s+)?(?:days?|months?|years?)\b", re.I)
+PERCENTAGE = re.compile(r"\b\d+(?:\.\d+)?\s*(?:%|per\s*cent\b|percent\b)", re.I)
+AMOUNT = re.compile(r"(?:Rs\.?|INR|₹)\s*[\d,]+(?:\.\d+)?|\b[\d,.]+\s*(?:lakhs?|crores?)\b", re.I)
+
+# Which kind of value answers each numeric intent
+INTENT_VALUES = {
+    "waiting_period": (DURATION,),
+    "grace_period": (DURATION,),
+    "discount_check": (PERCENTAGE,),
+    "limit_check": (PERCENTAGE, AMOUNT),
+}
+
+STOPWORDS = {"the", "a", "an", "of", "for", "on", "in", "to", "and", "or", "any", "this", "policy", "plan", "under"}
+
+
+def sentences(text):
+    return [sentence.strip() for sentence in SENTENCE_BREAK.split(" ".join(text.split())) if sentence.strip()]
+
+
+def entity_terms(entity):
+    return [word for word in re.findall(r"[a-z0-9]+", (entity or "").lower()) if word not in STOPWORDS]
+
+
+def term_overlap(terms, sentence):
+    if not terms:
+        return 1.0
+    lowered = sentence.lower()
+    return sum(1 for term in terms if term in lowered) / len(terms)
+
+
+def find_definition(entity, results):
+    """Candidate (sentence, rank, overlap) where the entity is defined"""
+    if not entity:
+        return []
+    pattern = re.compile(rf"['\"‘“]?{re.escape(entity)}['\"’”]?\s*(?:\([^)]*\)\s*)?{DEFINITION_VERBS}\b", re.I)
+    return [
+        (sentence, rank, 1.0)
+        for rank, result in enumerate(results)
+        for sentence in sentences(result["chunk"])
+        if pattern.search(sentence)
+    ]
+
+
+def find_values(intent, entity, results):
+    """Candidate (sentence, rank, overlap) that mention the intent and hold the kind of value it asks for"""
+    keywords = SECTION_KEYWORDS.get(intent, [])
+    value_patterns = INTENT_VALUES[intent]
+    terms = entity_terms(entity)
+    candidates = []
+    for rank, result in enumerate(results):
+        for sentence in sentences(result["chunk"]):
+            lowered = sentence.lower()
+            if keywords and not any(keyword in lowered for keyword in keywords):
+                continue
+            if not any(pattern.search(sentence) for pattern in value_patterns):
+                continue
+            candidates.append((sentence, rank, term_overlap(terms, sentence)))
+    return candidates
+
+
+def extract_answer(parsed, results):
+    """Answer span for definition and numeric lookups: (clause text, confidence), or (None, 0.0)"""
+    intent = parsed.get("intent")
+    if intent not in EXTRACTIVE_INTENTS or not results:
+        return None, 0.0
+    entity = (parsed.get("entity") or "").strip()
+
+    if intent == "definition_request":
+        candidates = find_definition(entity, results)
+    else:
+        candidates = find_values(intent, entity, results)
+    if not candidates:
+        return None, 0.0
+
+    # Best entity match first, then the highest ranked chunk
+    sentence, rank, overlap = max(candidates, key=lambda candidate: (candidate[2], -candidate[1]))
+    confidence = 0.5 + 0.3 * overlap
+    if rank == 0:
+        confidence += 0.1
+    # One clause, or several that agree, is unambiguous
+    if len({candidate[0] for candidate in candidates if candidate[2] == overlap}) == 1:
+        confidence += 0.1
+    return sentence, round(min(confidence, 1.0), 3)
@@ -0,0 +1,212 @@
+import re
+
+import numpy as np
+
+# Example questions per intent; their MiniLM embeddings act as the classifier's prototypes
+INTENT_EXAMPLES = {
+    "definition_request": [
+        "How does the policy define a hospital?",
+        "What is the definition of pre-existing disease?",
+        "What is meant by day care treatment?",
+    ],
+    "coverage_check": [
+        "Does this policy cover knee surgery?",
+        "Is maternity covered under the policy?",
+        "Are AYUSH treatments covered?",
+    ],
+    "waiting_period": [
+        "What is the waiting period for pre-existing diseases?",
+        "How long do I have to wait before cataract surgery is covered?",
+    ],
+    "grace_period": [
+        "What is the grace period for premium payment?",
+        "How many days do I get to renew after the due date?",
+    ],
+    "limit_check": [
+        "Are there any sub-limits on room rent and ICU charges?",
+        "What is the maximum amount payable for ambulance charges?",
+        "Is there a cap on cataract treatment expenses?",
+    ],
+    "discount_check": [
+        "What is the No Claim Discount offered in this policy?",
+        "Is there a discount on renewal premium?",
+    ],
+    "exclusion_check": [
+        "What are the exclusions of this policy?",
+        "Which treatments are not covered?",
+    ],
+    "claim_procedure": [
+        "How do I file a claim?",
+        "What documents are required for reimbursement?",
+    ],
+    "eligibility_check": [
+        "What is the entry age for this policy?",
+        "Who can be insured under this plan?",
+    ],
+}
+
+# Keyword rules checked before the embedding classifier; the first match wins
+INTENT_RULES = [
+    ("definition_request", re.compile(r"\b(define[sd]?|definition|meant by|meaning of)\b", re.I)),
+    ("waiting_period", re.compile(r"\bwaiting period\b|\bhow long\b.*\bwait\b", re.I)),
+    ("grace_period", re.compile(r"\bgrace period\b", re.I)),
+    ("discount_check", re.compile(r"\b(no claim (discount|bonus)|ncd|discount|cumulative bonus)\b", re.I)),
+    ("limit_check", re.compile(r"\b(sub-?limits?|limit|cap|maximum|ceiling|room rent|icu charges)\b", re.I)),
+    ("exclusion_check", re.compile(r"\b(exclusions?|excluded|not covered)\b", re.I)),
+    ("claim_procedure", re.compile(r"\b(claim (process|procedure)|file a claim|reimbursement|cashless|documents required)\b", re.I)),
+    ("eligibility_check", re.compile(r"\b(entry age|eligib\w*|who can)\b", re.I)),
+    ("coverage_check", re.compile(r"\b(cover(s|ed|age)?|benefit|indemnif\w*|payable)\b", re.I)),
+]
+
+# Intents answered by a single number or clause; used for retrieval hints and extractive answering
+NUMERIC_INTENTS = {"waiting_period", "grace_period", "limit_check", "discount_check"}
+
+ATTRIBUTE_KEYWORDS = {
+    "coverage": r"\bcover",
+    "conditions": r"\b(conditions?|criteria|requirements?)\b",
+    "waiting period": r"\bwaiting period\b",
+    "grace period": r"\bgrace period\b",
+    "limits": r"\b(sub-?limits?|limit|cap|maximum)\b",
+    "exclusions": r"\bexclu",
+    "discount": r"\b(discount|ncd|bonus)\b",
+    "definition": r"\b(define|definition|meant by)\b",
+    "eligibility": r"\b(age|eligib)",
+    "claims": r"\bclaims?\b",
+    "premium": r"\bpremium\b",
+}
+
+# Words added to the retrieval query so clauses phrased differently from the question still match
+INTENT_EXPANSIONS = {
+    "definition_request": "means defined as definition",
+    "waiting_period": "waiting period months continuous coverage",
+    "grace_period": "grace period days premium renewal",
+    "limit_check": "limit maximum sum insured per cent",
+    "discount_check": "no claim discount renewal premium",
+    "exclusion_check": "exclusions not covered",
+    "claim_procedure": "claim procedure documents notification",
+    "eligibility_check": "entry age eligibility",
+}
+
+# Terms a chunk from the right part of the policy is expected to contain
+SECTION_KEYWORDS = {
+    "definition_request": ["means", "defined"],
+    "waiting_period": ["waiting period"],
+    "grace_period": ["grace period"],
+    "discount_check": ["discount", "bonus"],
+    "exclusion_check": ["exclu"],
+    "claim_procedure": ["claim"],
+}
+
+ENTITY_PATTERNS = [
+    re.compile(r"(?<!\w)['\"‘“]([^'\"’”]{2,60})['\"’”]"),
+    re.compile(r"\b(?:define|defines|definition of|meant by|meaning of)\s+(?:an?\s+|the\s+)?(.+)", re.I),
+    re.compile(r"\b(?:waiting period|grace period|sub-?limits?|limits?|cap)\s+(?:for|on|of)\s+(.+)", re.I),
+    re.compile(r"\b(?:cover|covers|covered for|coverage for|coverage of|benefit for)\s+(.+)", re.I),
+    re.compile(r"^\s*(?:is|are)\s+(.+?)\s+(?:covered|excluded|payable|included)\b", re.I),
+    re.compile(r"\b(?:what is|what are)\s+(?:the\s+)?(.+)", re.I),
+]
+
+ENTITY_TRAILERS = re.compile(
+    r"\s*(?:,|\band\b (?:what|are|is)|\bunder\b|\bin this\b|\bin the\b|\bto be covered\b|"
+    r"\bcovered\b|\boffered\b|\bfor plan\b|\bunder the\b).*$",
+    re.I,
+)
+
+
+def extract_entity(query):
+    """Pull the main subject of the question out with simple patterns"""
+    for pattern in ENTITY_PATTERNS:
+        match = pattern.search(query)
+        if match:
+            entity = ENTITY_TRAILERS.sub("", match.group(1))
+            entity = re.sub(r"\b(this|the) (policy|plan)\b", "", entity, flags=re.I)
+            entity = entity.strip(" ?.!'\"").strip()
+            if entity:
+                return entity
+    return ""
+
+
+class LocalQueryParser:
+    """Rules plus a nearest-prototype intent classifier over MiniLM query embeddings.
+
+    Produces the same JSON schema as parse_query_with_gemini without a network
+    round trip. A confidence score tells the caller when to fall back to the LLM.
+    """
+
+    def __init__(self, encode_fn):
+        self.encode_fn = encode_fn
+        self.intents = list(INTENT_EXAMPLES)
+        prototypes = []
+        for intent in self.intents:
+            embeddings = np.asarray(encode_fn(INTENT_EXAMPLES[intent]), dtype="float32")
+            prototypes.append(embeddings.mean(axis=0))
+        self.prototypes = self._normalize(np.stack(prototypes))
+
+    @staticmethod
+    def _normalize(vectors):
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def classify(self, query_embedding):
+        """Return (intent, cosine similarity, margin over the runner-up)"""
+        similarities = self.prototypes @ self._normalize(np.asarray(query_embedding, dtype="float32"))
+        order = np.argsort(similarities)[::-1]
+        best, second = order[0], order[1]
+        return self.intents[best], float(similarities[best]), float(similarities[best] - similarities[second])
+
+    def parse(self, query, query_embedding=None):
+        """Parse a query into intent/entity/attributes, with a confidence between 0 and 1"""
+        if query_embedding is None:
+            query_embedding = self.encode_fn([query])[0]
+
+        rule_intent = next((intent for intent, rule in INTENT_RULES if rule.search(query)), None)
+        embedding_intent, similarity, margin = self.classify(query_embedding)
+
+        if rule_intent and rule_intent == embedding_intent:
+            intent, confidence = rule_intent, 0.95
+        elif rule_intent:
+            # Rules are precise but the embedding disagrees; trust the rule with less certainty
+            intent, confidence = rule_intent, 0.75
+        else:
+            intent = embedding_intent
+            confidence = float(np.clip(similarity * 0.6 + margin * 4.0, 0.0, 0.9))
+
+        attributes = [name for name, pattern in ATTRIBUTE_KEYWORDS.items() if re.search(pattern, query, re.I)]
+        return {
+            "intent": intent,
+            "entity": extract_entity(query),
+            "attributes": attributes or ["coverage"],
+            "context_type": "policy",
+            "output_format": "text",
+            "confidence": round(confidence, 3),
+            "source": "local",
+        }
+
+    def parse_batch(self, queries, query_embeddings=None):
+        if query_embeddings is None:
+            query_embeddings = self.encode_fn(list(queries))
+        return [self.parse(query, embedding) for query, embedding in zip(queries, query_embeddings)]
+
+
+def expand_query(query, parsed):
+    """Retrieval query with the entity and intent vocabulary appended"""
+    extra = [parsed.get("entity", ""), INTENT_EXPANSIONS.get(parsed.get("intent"), "")]
+    extra = " ".join(part for part in extra if part and part.lower() not in query.lower())
+    return f"{query} {extra}".strip()
+
+
+def prefer_section(results, parsed, top_k):
+    """Keep top_k results, moving chunks from the section the intent points at to the front"""
+    keywords = SECTION_KEYWORDS.get(parsed.get("intent"), [])
+    entity = (parsed.get("entity") or "").lower()
+    if entity:
+        keywords = keywords + [entity]
+    if not keywords:
+        return results[:top_k]
+
+    def in_section(result):
+        text = f"{result.get('section') or ''} {result['chunk']}".lower()
+        return any(keyword in text for keyword in keywords)
+
+    # Stable sort keeps the vector ranking within each group
+    return sorted(results, key=lambda result: not in_section(result))[:top_k]
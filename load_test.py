@@ -0,0 +1,250 @@
+import argparse
+import functools
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from urllib.parse import quote
+
+import requests
+
+from test_api import auth_token, test_data_url
+
+# Load generator for /api/v1/hackrx/run
+#
+#   python load_test.py --docs ./sample-pdfs --start-api --concurrency 1,2,4,8,16
+#   python load_test.py --docs ./sample-pdfs --base-url http://localhost:8000/api/v1 --rates 0.5,1,2,4
+#
+# Sample PDFs are served from a local static file server so downloads are not
+# the bottleneck. With --start-api the API runs with LLM_BACKEND=fake, so the
+# numbers measure our own pipeline rather than Gemini quota.
+
+DEFAULT_QUESTIONS = test_data_url["questions"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_file_server(directory):
+    """Serve directory over HTTP on a free port; returns (server, base url)"""
+    port = free_port()
+    server = ThreadingHTTPServer(("127.0.0.1", port), functools.partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{port}"
+
+
+def start_api(env_overrides, timeout=300):
+    """Run api_server on a free port with the fake LLM backend; returns (process, base url)"""
+    port = free_port()
+    env = dict(os.environ, LLM_BACKEND="fake", **env_overrides)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api_server:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}/api/v1"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("API server exited during startup")
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).ok:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("API server did not become healthy in time")
+
+
+def percentile(sorted_values, share):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * share))]
+
+
+class LoadGenerator:
+    def __init__(self, base_url, document_urls, questions, questions_per_request, request_timeout, seed=0):
+        self.base_url = base_url
+        self.document_urls = document_urls
+        self.questions = questions
+        self.questions_per_request = questions_per_request
+        self.request_timeout = request_timeout
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.headers = {"Authorization": f"Bearer {auth_token}", "Content-Type": "application/json"}
+
+    def make_payload(self):
+        with self.lock:
+            count = min(self.questions_per_request, len(self.questions))
+            return {
+                "documents": [self.random.choice(self.document_urls)],
+                "questions": self.random.sample(self.questions, count),
+            }
+
+    def send(self, scheduled_at=None):
+        """One submission; latency counts from the scheduled arrival so client-side queueing is included"""
+        started = scheduled_at or time.monotonic()
+        try:
+            response = requests.post(
+                f"{self.base_url}/hackrx/run", headers=self.headers, json=self.make_payload(),
+                timeout=self.request_timeout,
+            )
+            status = response.status_code
+        except requests.RequestException:
+            status = 0
+        return status, time.monotonic() - started
+
+    def run_closed(self, concurrency, duration):
+        """concurrency clients each send the next request as soon as the previous one finishes"""
+        results = []
+        deadline = time.monotonic() + duration
+
+        def client():
+            while time.monotonic() < deadline:
+                results.append(self.send())
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def run_open(self, rate, duration, max_outstanding):
+        """Poisson arrivals at rate requests/second, regardless of how fast the server answers"""
+        futures = []
+        deadline = time.monotonic() + duration
+        with ThreadPoolExecutor(max_workers=max_outstanding) as executor:
+            next_arrival = time.monotonic()
+            while next_arrival < deadline:
+                time.sleep(max(0.0, next_arrival - time.monotonic()))
+                futures.append(executor.submit(self.send, next_arrival))
+                next_arrival += self.random.expovariate(rate)
+        return [future.result() for future in futures]
+
+
+def summarize(level, results, elapsed):
+    latencies = sorted(latency for status, latency in results if status == 200)
+    total = len(results)
+    return {
+        "level": level,
+        "requests": total,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_s": percentile(latencies, 0.50),
+        "p90_s": percentile(latencies, 0.90),
+        "p99_s": percentile(latencies, 0.99),
+        "rate_429": sum(1 for status, _ in results if status == 429) / total if total else 0.0,
+        "error_rate": sum(1 for status, _ in results if status not in (200, 429)) / total if total else 0.0,
+    }
+
+
+def print_curve(label, rows):
+    print(f"\n{label:>10}{'requests':>10}{'ok/s':>8}{'p50 s':>8}{'p90 s':>8}{'p99 s':>8}{'429':>7}{'errors':>8}")
+    for row in rows:
+        print(
+            f"{row['level']:>10}{row['requests']:>10}{row['throughput_rps']:>8.2f}{row['p50_s']:>8.2f}"
+            f"{row['p90_s']:>8.2f}{row['p99_s']:>8.2f}{row['rate_429']:>7.1%}{row['error_rate']:>8.1%}"
+        )
+    # Saturation: the first level where more load stops buying throughput
+    for previous, row in zip(rows, rows[1:]):
+        if row["throughput_rps"] < previous["throughput_rps"] * 1.1:
+            print(f"Saturates around {previous['level']} ({previous['throughput_rps']:.2f} ok/s)")
+            break
+
+
+def parse_levels(text, cast):
+    return [cast(level) for level in text.split(",") if level.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /api/v1/hackrx/run")
+    parser.add_argument("--docs", required=True, help="Directory of sample PDFs to serve")
+    parser.add_argument("--base-url", default="http://localhost:8000/api/v1", help="API to test (ignored with --start-api)")
+    parser.add_argument("--start-api", action="store_true", help="Start api_server with LLM_BACKEND=fake")
+    parser.add_argument("--api-env", action="append", default=[], help="KEY=VALUE for the started API, repeatable")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="Closed-loop client counts, comma-separated")
+    parser.add_argument("--rates", default="", help="Open-loop arrival rates in requests/s, comma-separated")
+    parser.add_argument("--max-outstanding", type=int, default=64, help="Client cap on open-loop requests in flight")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per load level")
+    parser.add_argument("--warmup", type=int, default=1, help="Requests per document before measuring")
+    parser.add_argument("--questions", help="File with one question per line (default: sample policy questions)")
+    parser.add_argument("--questions-per-request", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    pdfs = sorted(name for name in os.listdir(args.docs) if name.lower().endswith(".pdf"))
+    if not pdfs:
+        print(f"No PDFs in {args.docs}")
+        sys.exit(1)
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    file_server, files_url = start_file_server(args.docs)
+    document_urls = [f"{files_url}/{quote(name)}" for name in pdfs]
+    api_process = None
+    try:
+        base_url = args.base_url
+        if args.start_api:
+            api_env = dict(item.split("=", 1) for item in args.api_env)
+            api_process, base_url = start_api(api_env)
+        print(f"Testing {base_url} with {len(pdfs)} documents and {len(questions)} questions")
+
+        generator = LoadGenerator(
+            base_url, document_urls, questions, args.questions_per_request, args.timeout, args.seed
+        )
+        # Index every document once so the curve measures steady state, not first-time ingestion
+        for document_url in document_urls:
+            for _ in range(args.warmup):
+                generator.document_urls = [document_url]
+                status, latency = generator.send()
+                print(f"Warm-up {document_url}: {status} in {latency:.1f}s")
+        generator.document_urls = document_urls
+
+        if args.concurrency:
+            rows = []
+            for concurrency in parse_levels(args.concurrency, int):
+                started = time.monotonic()
+                results = generator.run_closed(concurrency, args.duration)
+                rows.append(summarize(concurrency, results, time.monotonic() - started))
+                print(f"concurrency {concurrency}: {rows[-1]['requests']} requests")
+            print_curve("clients", rows)
+
+        if args.rates:
+            rows = []
+            for rate in parse_levels(args.rates, float):
+                started = time.monotonic()
+                results = generator.run_open(rate, args.duration, args.max_outstanding)
+                rows.append(summarize(rate, results, time.monotonic() - started))
+                print(f"rate {rate}/s: {rows[-1]['requests']} requests")
+            print_curve("req/s", rows)
+
+        try:
+            print("\nServer metrics:", requests.get(f"{base_url}/metrics", timeout=5).json())
+        except requests.RequestException:
+            pass
+    finally:
+        file_server.shutdown()
+        if api_process is not None:
+            api_process.terminate()
+            api_process.wait()
+
+
+if __name__ == "__main__":
+    main()
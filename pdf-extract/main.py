@@ -6,20 +6,37 @@ import os
 from docx import Document
 import email
 import zipfile
+import hashlib
+import io
+import re
+import json
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import win32com.client
 
-def create_output_structure(file_path):
-    """Create folder structure based on the input file name"""
+# PyMuPDF is not thread-safe: every fitz call in this process, from any pool, holds this lock
+FITZ_LOCK = threading.RLock()
+
+def create_output_structure(file_path, root=None, images_folder=None):
+    """Create folder structure based on the input file name
+    
+    root: parent directory for the extracted_<name> folder (default: current directory);
+    give each concurrent extraction its own root so they never write into the same folder.
+    images_folder: write images there instead (e.g. a per-document cache shared by extractions).
+    """
     base_name = Path(file_path).stem  # Get filename without extension
     base_folder = f"extracted_{base_name}"
+    if root:
+        base_folder = os.path.join(root, base_folder)
     
     # Create main folder and subfolders
     folders = {
         'main': base_folder,
         'text': os.path.join(base_folder, 'text'),
         'tables': os.path.join(base_folder, 'tables'),
-        'images': os.path.join(base_folder, 'images')
+        'images': images_folder or os.path.join(base_folder, 'images')
     }
     
     for folder in folders.values():
@@ -27,45 +44,31 @@ def create_output_structure(file_path):
     
     return folders
 
-def extract_from_pdf(pdf_path, folders):
-    """Extract text, tables, and images from PDF"""
+def extract_from_pdf(pdf_path, folders, images="eager"):
+    """Extract text, tables, and images from PDF
+    
+    images: "eager" writes images before returning, "background" writes them in the
+    image thread pool while tables are extracted, "on_demand" only writes the image
+    index, "off" skips images. Returns once every file is written, so the caller
+    knows when the PDF and folders are no longer in use.
+    """
     print(f"Processing PDF: {pdf_path}")
     
     # === TEXT EXTRACTION ===
     print("Extracting text from PDF...")
-    doc = fitz.open(pdf_path)
     text_file = os.path.join(folders['text'], "pdf_text.txt")
     
-    with open(text_file, "wb") as out:
+    with FITZ_LOCK, open(text_file, "wb") as out:
+        doc = fitz.open(pdf_path)
         for page in doc:
             text = page.get_text().encode("utf8")
             out.write(text)
             out.write(bytes((12,)))  # page delimiter
+        doc.close()
     print("PDF text extraction completed!")
 
     # === IMAGE EXTRACTION ===
-    print("Extracting images from PDF...")
-    image_count = 0
-    for page_index in range(len(doc)):
-        page = doc[page_index]
-        image_list = page.get_images()
-
-        if image_list:
-            print(f"Found {len(image_list)} images on page {page_index + 1}")
-        
-        for image_index, img in enumerate(image_list, start=1):
-            xref = img[0]
-            pix = pymupdf.Pixmap(doc, xref)
-
-            if pix.n - pix.alpha > 3:
-                pix = pymupdf.Pixmap(pymupdf.csRGB, pix)
-
-            image_file = os.path.join(folders['images'], f"pdf_page_{page_index + 1}_image_{image_index}.png")
-            pix.save(image_file)
-            pix = None
-            image_count += 1
-    
-    print(f"PDF image extraction completed! ({image_count} images)")
+    image_job = extract_images_from_pdf(pdf_path, folders, mode=images)
 
     # === TABLE EXTRACTION ===
     print("Extracting tables from PDF...")
@@ -112,7 +115,188 @@ def extract_from_pdf(pdf_path, folders):
             summary_df.to_csv(summary_file, index=False)
             print(f"PDF tables extracted: {len(all_tables_data)}")
     
-    doc.close()
+    if images == "background":
+        image_job.result()
+
+# Images smaller than this (in pixels, either side) are bullets, spacers or rules - not content
+IMAGE_MIN_SIZE = int(os.getenv("IMAGE_MIN_SIZE", "32"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+_image_executor = None
+
+def get_image_executor():
+    """Thread pool that encodes images off the request path"""
+    global _image_executor
+    if _image_executor is None:
+        _image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="pdf-images")
+    return _image_executor
+
+def image_file_name(xref):
+    return f"pdf_image_{xref}.png"
+
+def list_unique_images(doc, min_size=IMAGE_MIN_SIZE):
+    """Map each distinct image to the pages it appears on, without decoding any pixels.
+    
+    Images are deduplicated by xref and by a hash of their raw stream, so a logo
+    repeated on every page (even under different xrefs) is listed once.
+    """
+    images = {}
+    xref_digests = {}
+    for page_index in range(len(doc)):
+        for img in doc[page_index].get_images(full=True):
+            xref, width, height = img[0], img[2], img[3]
+            if width < min_size or height < min_size:
+                continue
+            
+            digest = xref_digests.get(xref)
+            if digest is None:
+                digest = hashlib.sha1(doc.xref_stream_raw(xref) or b"").hexdigest()
+                xref_digests[xref] = digest
+            
+            entry = images.setdefault(digest, {
+                'xref': xref,
+                'width': width,
+                'height': height,
+                'filename': image_file_name(xref),
+                'pages': [],
+            })
+            if page_index + 1 not in entry['pages']:
+                entry['pages'].append(page_index + 1)
+    return list(images.values())
+
+def render_image(doc, xref, image_file):
+    """Decode one image xref and save it as PNG"""
+    pix = pymupdf.Pixmap(doc, xref)
+    if pix.n - pix.alpha > 3:
+        pix = pymupdf.Pixmap(pymupdf.csRGB, pix)
+    pix.save(image_file)
+    pix = None
+
+def list_pdf_images(pdf_path, min_size=IMAGE_MIN_SIZE):
+    """Distinct images of a PDF file (see list_unique_images)"""
+    with FITZ_LOCK:
+        doc = fitz.open(pdf_path)
+        try:
+            return list_unique_images(doc, min_size)
+        finally:
+            doc.close()
+
+def save_image_file(doc, xref, image_file):
+    """Render one image beside image_file and swap it in, so a concurrent reader never sees half a PNG"""
+    fd, tmp_file = tempfile.mkstemp(suffix=".png", dir=os.path.dirname(image_file))
+    os.close(fd)
+    try:
+        render_image(doc, xref, tmp_file)
+        os.replace(tmp_file, image_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+def render_pdf_image(pdf_path, xref, image_file):
+    """Render one image of a PDF to image_file; False if the PDF has no such image"""
+    with FITZ_LOCK:
+        doc = fitz.open(pdf_path)
+        try:
+            if xref not in {img[0] for page in doc for img in page.get_images()}:
+                return False
+            os.makedirs(os.path.dirname(image_file), exist_ok=True)
+            save_image_file(doc, xref, image_file)
+            return True
+        finally:
+            doc.close()
+
+def write_image_index(images, images_folder):
+    with open(os.path.join(images_folder, "images_index.json"), "w", encoding="utf-8") as f:
+        json.dump(images, f, indent=2)
+
+def save_unique_images(pdf_path, images, images_folder):
+    """Decode and write each distinct image once (images already in the folder are kept)"""
+    # One image per lock hold, so page extraction for other requests is not stalled behind all of them
+    with FITZ_LOCK:
+        doc = fitz.open(pdf_path)
+    try:
+        for entry in images:
+            image_file = os.path.join(images_folder, entry['filename'])
+            if os.path.exists(image_file):
+                continue
+            with FITZ_LOCK:
+                save_image_file(doc, entry['xref'], image_file)
+    finally:
+        with FITZ_LOCK:
+            doc.close()
+    write_image_index(images, images_folder)
+    print(f"PDF image extraction completed! ({len(images)} unique images)")
+    return len(images)
+
+def extract_images_from_pdf(pdf_path, folders, mode="eager", min_size=IMAGE_MIN_SIZE):
+    """Extract distinct images; returns a Future in "background" mode"""
+    if mode == "off":
+        return None
+    
+    print("Extracting images from PDF...")
+    images = list_pdf_images(pdf_path, min_size)
+    
+    if mode == "eager":
+        return save_unique_images(pdf_path, images, folders['images'])
+    if mode == "background":
+        return get_image_executor().submit(save_unique_images, pdf_path, images, folders['images'])
+    
+    # on_demand - record what exists; images are rendered when requested
+    write_image_index(images, folders['images'])
+    return images
+
+def compute_page_hashes(pdf_path):
+    """Hash each page's raw content stream so unchanged pages are found without extracting text"""
+    hashes = []
+    with FITZ_LOCK:
+        doc = fitz.open(pdf_path)
+        for page in doc:
+            digest = hashlib.sha256()
+            digest.update(repr(tuple(page.rect)).encode())
+            digest.update(page.read_contents())
+            hashes.append(digest.hexdigest())
+        doc.close()
+    return hashes
+
+def extract_page_texts(pdf_path, page_numbers):
+    """Extract text of selected pages only (0-based page numbers)"""
+    with FITZ_LOCK:
+        doc = fitz.open(pdf_path)
+        texts = {page_number: doc[page_number].get_text() for page_number in page_numbers}
+        doc.close()
+    return texts
+
+# Lines set at least this much larger than a page's body text are treated as section headings
+HEADING_SIZE_RATIO = float(os.getenv("HEADING_SIZE_RATIO", "1.15"))
+
+def page_headings(page):
+    """Short lines in a larger font than the page's body text, in reading order"""
+    lines = []
+    chars_by_size = {}
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            spans = [span for span in line["spans"] if span["text"].strip()]
+            if not spans:
+                continue
+            lines.append(("".join(span["text"] for span in spans).strip(), max(span["size"] for span in spans)))
+            for span in spans:
+                size = round(span["size"], 1)
+                chars_by_size[size] = chars_by_size.get(size, 0) + len(span["text"])
+    if not chars_by_size:
+        return []
+    # The size most characters are set in is the body text
+    body_size = max(chars_by_size, key=chars_by_size.get)
+    return [
+        text for text, size in lines
+        if size >= body_size * HEADING_SIZE_RATIO and 3 <= len(text) <= 100 and any(c.isalpha() for c in text)
+    ]
+
+def extract_page_headings(pdf_path, page_numbers):
+    """Large-font heading lines of selected pages (0-based page numbers)"""
+    with FITZ_LOCK:
+        doc = fitz.open(pdf_path)
+        headings = {page_number: page_headings(doc[page_number]) for page_number in page_numbers}
+        doc.close()
+    return headings
 
 def extract_from_docx(docx_path, folders):
     """Extract text, tables, and images from DOCX"""
@@ -260,6 +444,124 @@ def extract_from_msg(msg_path, folders):
     except Exception as e:
         print(f"Error processing MSG file: {e}")
 
+# === IN-MEMORY EXTRACTION (used by the API) ===
+PAGE_DELIMITER = "\x0c"
+
+# Headers an RFC 822 message starts with
+EML_HEADER = re.compile(
+    rb"^(Return-Path|Received|From|To|Subject|Date|Message-ID|MIME-Version|Delivered-To|X-[\w-]+):",
+    re.IGNORECASE,
+)
+
+CONTENT_TYPE_FORMATS = {
+    'application/pdf': 'pdf',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 'docx',
+    'message/rfc822': 'eml',
+}
+
+def detect_format(data, content_type=None, filename=None):
+    """Detect document format from magic bytes, falling back to content type and file extension"""
+    head = data[:2048].lstrip()
+    if head.startswith(b'%PDF-'):
+        return 'pdf'
+    if data[:4] == b'PK\x03\x04':
+        try:
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                if 'word/document.xml' in archive.namelist():
+                    return 'docx'
+        except zipfile.BadZipFile:
+            pass
+    if EML_HEADER.match(head):
+        return 'eml'
+    
+    if content_type:
+        fmt = CONTENT_TYPE_FORMATS.get(content_type.split(';')[0].strip().lower())
+        if fmt:
+            return fmt
+    if filename:
+        ext = Path(filename).suffix.lower().lstrip('.')
+        if ext in ('pdf', 'docx', 'eml'):
+            return ext
+    return 'text'
+
+def extract_pdf_text_from_bytes(data):
+    """Extract text from PDF bytes, one form-feed terminated block per page"""
+    with FITZ_LOCK:
+        doc = fitz.open(stream=data, filetype="pdf")
+        text = "".join(page.get_text() + PAGE_DELIMITER for page in doc)
+        doc.close()
+    return text
+
+def extract_docx_text_from_bytes(data):
+    """Extract paragraph and table text from DOCX bytes"""
+    doc = Document(io.BytesIO(data))
+    lines = [paragraph.text for paragraph in doc.paragraphs if paragraph.text.strip()]
+    for table in doc.tables:
+        for row in table.rows:
+            lines.append(" | ".join(cell.text.strip() for cell in row.cells))
+    return "\n".join(lines)
+
+def extract_eml_from_bytes(data):
+    """Return (text, attachments) for EML bytes; attachments is a list of (filename, bytes, content_type)"""
+    msg = email.message_from_bytes(data)
+    
+    plain_parts = []
+    html_parts = []
+    attachments = []
+    for part in msg.walk():
+        if part.is_multipart():
+            continue
+        content_type = part.get_content_type()
+        content_disposition = str(part.get("Content-Disposition"))
+        payload = part.get_payload(decode=True) or b""
+        
+        if part.get_filename() or "attachment" in content_disposition:
+            attachments.append((part.get_filename() or "attachment", payload, content_type))
+        elif content_type == "text/plain":
+            plain_parts.append(payload.decode(part.get_content_charset() or 'utf-8', errors='ignore'))
+        elif content_type == "text/html":
+            html = payload.decode(part.get_content_charset() or 'utf-8', errors='ignore')
+            html_parts.append(re.sub(r"<[^>]+>", " ", html))
+    
+    body = "\n".join(plain_parts or html_parts)
+    text = (
+        f"Subject: {msg.get('Subject', 'No Subject')}\n"
+        f"From: {msg.get('From', 'Unknown Sender')}\n"
+        f"Date: {msg.get('Date', 'Unknown Date')}\n"
+        f"Body:\n{body}"
+    )
+    return text, attachments
+
+def extract_text_from_bytes(data, content_type=None, filename=None, max_depth=2):
+    """Extract text from PDF, DOCX, EML or plain-text bytes without writing anything to disk.
+    
+    PDF and DOCX attachments of an email are extracted concurrently and appended
+    after the email body, each starting on a new page.
+    """
+    fmt = detect_format(data, content_type, filename)
+    if fmt == 'pdf':
+        return extract_pdf_text_from_bytes(data)
+    if fmt == 'docx':
+        return extract_docx_text_from_bytes(data) + PAGE_DELIMITER
+    if fmt == 'text':
+        return data.decode('utf-8', errors='ignore')
+    
+    text, attachments = extract_eml_from_bytes(data)
+    parts = [text + PAGE_DELIMITER]
+    if max_depth > 0:
+        documents = [
+            attachment for attachment in attachments
+            if detect_format(attachment[1], attachment[2], attachment[0]) in ('pdf', 'docx', 'eml')
+        ]
+        if documents:
+            with ThreadPoolExecutor(max_workers=min(4, len(documents))) as pool:
+                extracted = pool.map(
+                    lambda a: extract_text_from_bytes(a[1], a[2], a[0], max_depth - 1), documents
+                )
+                for (attachment_name, _, _), attachment_text in zip(documents, extracted):
+                    parts.append(f"Attachment: {attachment_name}\n{attachment_text}")
+    return "".join(parts)
+
 def process_document(file_path):
     """Main function to process any supported document type"""
     file_ext = Path(file_path).suffix.lower()
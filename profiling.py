@@ -0,0 +1,161 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+
+class StackSampler:
+    """Samples the Python stacks of every thread at a fixed interval.
+
+    Submissions run across the event loop and the stage executors, so a
+    deterministic profiler on one thread would miss most of the work. Those
+    threads are shared, so the samples include whatever other requests run
+    at the same time. Counts
+    are kept as collapsed stacks ("outer;inner;leaf count"), the input format
+    of flamegraph.pl and speedscope. Work in extraction worker processes is
+    not visible here.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                frames.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(frames))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+class Profiler:
+    """Opt-in capture of a stack profile and tracemalloc snapshot while a submission runs.
+
+    Stacks and allocations are process-wide: a profile covers the window of
+    one submission, including any other requests served during it. Profile
+    on an otherwise idle server to see one submission alone. Only one
+    profile runs at a time; a request that asks while another is being
+    profiled runs unprofiled and does not use up an armed count.
+    Unprofiled requests pay nothing beyond a flag check. Only the snapshot is
+    taken where the block ends; filtering it and writing the files is handed to
+    write_fn(fn, *args), e.g. an executor, so an event loop is not blocked.
+    """
+
+    FILES = ("summary.json", "stacks.txt", "memory.txt")
+
+    def __init__(self, root, interval=0.005, top_allocations=50, write_fn=None):
+        self.root = root
+        self.write_fn = write_fn or (lambda fn, *args: fn(*args))
+        self.interval = interval
+        self.top_allocations = top_allocations
+        self.armed = 0
+        self._busy = threading.Lock()
+
+    def arm(self, count=1):
+        """Profile the next count submissions even without the request header"""
+        self.armed += count
+        return self.armed
+
+    @contextmanager
+    def capture(self, requested=False, label=""):
+        """Profile the enclosed block if requested or armed; yields the profile id, or None if not profiled"""
+        if not (requested or self.armed > 0) or not self._busy.acquire(blocking=False):
+            yield None
+            return
+        if not requested:
+            self.armed = max(0, self.armed - 1)
+        profile_id = uuid.uuid4().hex
+        sampler = StackSampler(self.interval)
+        tracemalloc.start(25)
+        sampler.start()
+        started = time.perf_counter()
+        error = None
+        try:
+            yield profile_id
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            sampler.stop()
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self._busy.release()
+            self.write_fn(self._write, profile_id, label, elapsed, sampler, snapshot, current, peak, error)
+
+    def _write(self, profile_id, label, elapsed, sampler, snapshot, current, peak, error):
+        profile_dir = os.path.join(self.root, profile_id)
+        os.makedirs(profile_dir, exist_ok=True)
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        stats = snapshot.statistics("lineno")[:self.top_allocations]
+        with open(os.path.join(profile_dir, "memory.txt"), "w", encoding="utf-8") as f:
+            f.write(f"Traced memory: {current / 1e6:.1f} MB live, {peak / 1e6:.1f} MB peak\n")
+            f.write(f"Top {len(stats)} allocation sites still live at the end of the request:\n")
+            for stat in stats:
+                f.write(f"{stat}\n")
+        with open(os.path.join(profile_dir, "stacks.txt"), "w", encoding="utf-8") as f:
+            f.write(sampler.collapsed())
+        with open(os.path.join(profile_dir, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "profile_id": profile_id,
+                "label": label,
+                "scope": "process",
+                "created_at": time.time(),
+                "elapsed_seconds": elapsed,
+                "samples": sampler.samples,
+                "sample_interval_seconds": self.interval,
+                "traced_memory_bytes": current,
+                "traced_peak_bytes": peak,
+                "error": error,
+            }, f, indent=2)
+
+    def list(self):
+        if not os.path.isdir(self.root):
+            return []
+        summaries = []
+        for profile_id in os.listdir(self.root):
+            path = os.path.join(self.root, profile_id, "summary.json")
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    summaries.append(json.load(f))
+        return sorted(summaries, key=lambda summary: summary["created_at"], reverse=True)
+
+    def path(self, profile_id, file_name):
+        """Path of a stored profile file, or None for unknown ids or files"""
+        if file_name not in self.FILES or not all(c in "0123456789abcdef" for c in profile_id):
+            return None
+        path = os.path.join(self.root, profile_id, file_name)
+        return path if os.path.exists(path) else None
@@ -0,0 +1,100 @@
+import asyncio
+import functools
+import importlib.util
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Modules loaded inside extraction worker processes, keyed by file path
+_worker_modules = {}
+
+
+def _call_module_function(module_path, function_name, args, kwargs):
+    """Run a function from a module file inside a worker process.
+
+    The API loads pdf-extract/main.py under a synthetic module name, which a
+    child process cannot import by name, so workers load it from its path.
+    """
+    module = _worker_modules.get(module_path)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(f"worker_module_{len(_worker_modules)}", module_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _worker_modules[module_path] = module
+    return getattr(module, function_name)(*args, **kwargs)
+
+
+class StageScheduler:
+    """Runs blocking work on per-stage executors so the event loop stays free.
+
+    Stages:
+      io      - downloads, file reads/writes, index loading (threads)
+      extract - PDF/DOCX/EML parsing and image rendering (processes by default, since PyMuPDF
+                is not thread-safe; threads serialize on pdf_main.FITZ_LOCK). Worker processes
+                are spawned, not forked: forking after torch has started its thread pools can
+                deadlock the child
+      embed   - sentence embedding and FAISS search (threads; both release the GIL)
+      llm     - synchronous Gemini calls (threads)
+    """
+
+    def __init__(self, io_workers=16, extract_workers=2, embed_workers=2, llm_workers=8, extract_executor="process"):
+        self.extract_in_processes = extract_executor == "process"
+        self.executors = {
+            "io": ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="stage-io"),
+            "extract": (
+                ProcessPoolExecutor(max_workers=extract_workers, mp_context=multiprocessing.get_context("spawn"))
+                if self.extract_in_processes
+                else ThreadPoolExecutor(max_workers=extract_workers, thread_name_prefix="stage-extract")
+            ),
+            "embed": ThreadPoolExecutor(max_workers=embed_workers, thread_name_prefix="stage-embed"),
+            "llm": ThreadPoolExecutor(max_workers=llm_workers, thread_name_prefix="stage-llm"),
+        }
+        self.sizes = {
+            "io": io_workers,
+            "extract": extract_workers,
+            "embed": embed_workers,
+            "llm": llm_workers,
+        }
+        self.pending = {stage: 0 for stage in self.executors}
+        self.completed = {stage: 0 for stage in self.executors}
+        self.busy_seconds = {stage: 0.0 for stage in self.executors}
+
+    async def _submit(self, stage, fn):
+        loop = asyncio.get_running_loop()
+        self.pending[stage] += 1
+        started = time.monotonic()
+        try:
+            return await loop.run_in_executor(self.executors[stage], fn)
+        finally:
+            self.pending[stage] -= 1
+            self.completed[stage] += 1
+            self.busy_seconds[stage] += time.monotonic() - started
+
+    async def run(self, stage, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the stage's executor (thread stages only for arbitrary callables)"""
+        if stage == "extract" and self.extract_in_processes:
+            raise ValueError("Use run_in_module for the extract stage when it runs in processes")
+        return await self._submit(stage, functools.partial(fn, *args, **kwargs))
+
+    async def run_in_module(self, stage, module, function_name, *args, **kwargs):
+        """Run module.function_name(*args, **kwargs); picklable across process pools"""
+        if stage == "extract" and self.extract_in_processes:
+            call = functools.partial(_call_module_function, module.__file__, function_name, args, kwargs)
+        else:
+            call = functools.partial(getattr(module, function_name), *args, **kwargs)
+        return await self._submit(stage, call)
+
+    def metrics(self):
+        return {
+            stage: {
+                "workers": self.sizes[stage],
+                "pending": self.pending[stage],
+                "completed_total": self.completed[stage],
+                "busy_seconds_total": round(self.busy_seconds[stage], 3),
+            }
+            for stage in self.executors
+        }
+
+    def shutdown(self):
+        for executor in self.executors.values():
+            executor.shutdown(wait=False)